@@ -6,11 +6,17 @@ Extract TLisp API data from Debug.log
 
 import re
 import os
+import sys
 import os.path
+import mmap
+import filecmp
 import argparse
 
 from sphinx.util import rst
 
+from sphinxtlisp.tlisp import parse_function_list
+from sphinxtlisp.database import write_database
+
 func_map = {
     "!="   : "_ne",
     "*"    : "_mul",
@@ -43,8 +49,14 @@ else:
         #'show-inheritance',
         ]
 
-debuglog_re = re.compile(r'^(?:\d\d/\d\d/\d\d\d\d\s\d\d\:\d\d\:\d\d\t)?(.*)$', re.VERBOSE)
+FUNCTION_LIST = "function_list.txt"
+FUNCTION_DB = "function_list.jsonl"
+# The pages written by the last run, so only those are removed when stale
+MANIFEST = ".apidoc-manifest"
+
+debuglog_re = re.compile(br'^(?:\d\d/\d\d/\d\d\d\d\s\d\d\:\d\d\:\d\d\t)?(.*)$', re.VERBOSE)
 alphanum_re = re.compile(r'^\w+$')
+prefix_re = re.compile(r'^([a-z]+)[A-Z0-9]')
 
 def format_heading(level, text, escape=True):
     # type: (int, unicode, bool) -> unicode
@@ -64,63 +76,290 @@ def format_directive(name):
     return directive
 
 
-def parse_log(logfile, outfile="function_list.txt"):
+def _find_section(mm, marker):
+    """
+    Return the offset of the first line of the section headed by *marker*
+    (skipping the separator line after it), or -1 if there is none.
+    """
+    pos = mm.find(marker)
+    while pos >= 0:
+        start = mm.rfind(b'\n', 0, pos) + 1
+        end = mm.find(b'\n', pos)
+        if end < 0:
+            end = len(mm)
+        line = debuglog_re.match(mm[start:end].rstrip(b'\r')).group(1)
+        if line == marker:
+            # Skip the separator following the marker
+            end = mm.find(b'\n', end + 1)
+            return len(mm) if end < 0 else end + 1
+        pos = mm.find(marker, end)
+    return -1
+
+
+def _section_lines(mm, pos):
+    """Yield the timestamp stripped lines of a section starting at *pos*"""
+    size = len(mm)
+    while pos < size:
+        end = mm.find(b'\n', pos)
+        if end < 0:
+            end = size
+        line = debuglog_re.match(mm[pos:end].rstrip(b'\r')).group(1)
+        if line.startswith(b';###'):
+            return
+        yield line
+        pos = end + 1
+
+
+def parse_log(logfile, outfile=FUNCTION_LIST):
+    """
+    Extract the symbol list and function help from a Debug.log. The log is
+    memory mapped and only the two marker delimited sections are scanned,
+    so the size of the rest of the log does not matter. *outfile* is only
+    replaced if the log has function help and it changed.
+    """
     symbols = {}
-    mode = None
-    outf = open(outfile, "w")
-    with open(logfile) as fh:
-        for l in fh:
-            # Strip the timestamp if present
-            try:
-                line = debuglog_re.match(l).groups()[0]
-            except:
-                print(l)
-                raise
-            
-            if not mode:
-                if line == ";Symbol List":
-                    mode = "list"
-                    next(fh)
-                elif line ==";Function Help":
-                    mode = "help"
-                    next(fh)
-            elif mode == "list":
-                if line.startswith(";###"):
-                    mode = None
-                else:
-                    parts = line.split()
+    tmpfile = outfile + ".tmp"
+    with open(logfile, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return symbols
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = _find_section(mm, b";Symbol List")
+            if pos >= 0:
+                for line in _section_lines(mm, pos):
+                    parts = line.decode("latin-1").split()
+                    if len(parts) < 2:
+                        continue
                     stype = parts[1].strip(":")
-                    if stype not in symbols:
-                        symbols[stype] = []
-                    symbols[stype].append(parts[0])
-            elif mode == "help":
-                if line.startswith(";###"):
-                    mode = "done"
-                else:
-                    outf.write(line + "\n")
-    outf.close()
+                    symbols.setdefault(stype, []).append(parts[0])
+            pos = _find_section(mm, b";Function Help")
+            if pos < 0:
+                # Keep the function list rather than empty it
+                print("No ;Function Help section in %s, %s not updated"
+                      % (logfile, outfile))
+                return symbols
+            with open(tmpfile, "wb", 1 << 16) as outf:
+                for line in _section_lines(mm, pos):
+                    outf.write(line + b"\n")
+        finally:
+            mm.close()
+    if os.path.isfile(outfile) and filecmp.cmp(tmpfile, outfile, shallow=False):
+        os.remove(tmpfile)
+    else:
+        os.replace(tmpfile, outfile)
     return symbols
 
-def write_file(path, name, text):
-    fname = os.path.join(path, "%s.%s" % (name, "rst"))
-    with open(fname, "w") as f:
+def write_file(path, name, text, ext="rst"):
+    """Write a page unless it already has this text. Returns True if written"""
+    fname = os.path.join(path, "%s.%s" % (name, ext))
+    try:
+        with open(fname, encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except (IOError, OSError):
+        pass
+    with open(fname, "w", encoding="utf-8") as f:
         f.write(text)
+    return True
+
+
+def read_manifest(path):
+    """Return the names of the pages apidoc generated in *path* last time"""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return set(line.strip() for line in f if line.strip())
+    except (IOError, OSError):
+        return set()
 
 
-def main():
-    symbols = parse_log("../../Debug.log")
-    
-    os.makedirs("source/autogen", exist_ok=True)
-    for name in symbols['builtin']:
-        text = format_heading(1, name)
-        text += format_directive("(%s)"%name)
+def remove_stale(path, keep):
+    """
+    Remove the pages in *path* that apidoc generated last time but are not
+    in *keep* (page names without extension), and record *keep* as the
+    generated pages. Returns the names removed. Pages not in the manifest
+    are left alone, as they were not generated.
+    """
+    removed = []
+    for name in sorted(read_manifest(path) - set(keep)):
+        fname = os.path.join(path, "%s.%s" % (name, "rst"))
+        if os.path.isfile(fname):
+            os.remove(fname)
+            removed.append(name)
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        f.write("".join("%s\n" % name for name in sorted(keep)))
+    return removed
 
+
+def read_functions(fnc_file):
+    """Return {name: (signature, docstring)} for a function list, if any"""
+    if not os.path.isfile(fnc_file):
+        return {}
+    catalog = parse_function_list(fnc_file)
+    return dict((catalog.signature(key).name, (sig, doc))
+                for key, (sig, doc) in catalog.raw_items())
+
+
+def diff_functions(old, new):
+    """Return the names (added, removed, changed) between two function lists"""
+    added = sorted(set(new) - set(old), key=str.lower)
+    removed = sorted(set(old) - set(new), key=str.lower)
+    changed = sorted((name for name in set(old) & set(new)
+                      if old[name] != new[name]), key=str.lower)
+    return added, removed, changed
+
+
+def report(label, names, limit=20):
+    if names:
+        more = " and %d more" % (len(names) - limit) if len(names) > limit else ""
+        print("%s (%d): %s%s" % (label, len(names), ", ".join(names[:limit]),
+                                 more))
+
+
+def shard_by_prefix(names, min_size=3):
+    """
+    Group function names on their lower case prefix (obj, sys, cnv...).
+    Operators get their own group; plain names and prefixes with fewer than
+    *min_size* functions go into 'core'.
+    """
+    groups = {}
+    for name in names:
+        m = prefix_re.match(name)
         if name in func_map:
-            write_file("source/autogen", func_map[name], text)
-        elif alphanum_re.match(name):
-            write_file("source/autogen", name, text)
+            key = "operators"
+        elif m:
+            key = m.group(1)
+        else:
+            key = "core"
+        groups.setdefault(key, []).append(name)
+    for key in [k for k, v in groups.items() if len(v) < min_size]:
+        if key not in ("core", "operators"):
+            groups.setdefault("core", []).extend(groups.pop(key))
+    return dict((key, sorted(v, key=str.lower)) for key, v in groups.items())
+
+
+def shard_by_size(names, size=50):
+    """Split the sorted function names into groups of at most *size*"""
+    names = sorted(names, key=str.lower)
+    return dict(("functions%02d" % (i // size + 1), names[i:i + size])
+                for i in range(0, len(names), size))
+
+
+def format_version_index(version):
+    """Create the page listing the functions of an older API version"""
+    text = format_heading(1, "Version %s Functions" % version)
+    text += ".. toctree::\n   :maxdepth: 2\n   :glob:\n\n   *\n"
+    return text
+
+
+def version_paths(version, output_dir):
+    """
+    Return the function list, function database and page directory for
+    *version*, or the defaults if it is None.
+    """
+    if not version:
+        return FUNCTION_LIST, FUNCTION_DB, output_dir
+    base, ext = os.path.splitext(FUNCTION_LIST)
+    function_list = "%s-%s%s" % (base, version, ext)
+    base, ext = os.path.splitext(FUNCTION_DB)
+    function_db = "%s-%s%s" % (base, version, ext)
+    return function_list, function_db, os.path.join(output_dir, version)
+
+
+def format_shard(title, names):
+    """Create a page documenting several functions, one section each"""
+    text = format_heading(1, title)
+    for name in names:
+        text += format_heading(2, name)
+        text += format_directive("(%s)" % name)
+        text += "\n"
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("logfile", nargs="?", default="../../Debug.log",
+                        help="Transcendence Debug.log to extract from")
+    parser.add_argument("-o", "--output-dir", default="source/autogen",
+                        help="directory for the generated pages")
+    parser.add_argument("--shard", choices=("none", "prefix", "size"),
+                        default="none",
+                        help="one page per function (default), or group "
+                             "functions by name prefix or into fixed size "
+                             "pages")
+    parser.add_argument("--shard-size", type=int, default=50,
+                        help="functions per page with --shard=size")
+    parser.add_argument("--format", choices=("text", "jsonl"),
+                        default="text",
+                        help="also write the function help as a function "
+                             "database, function_list.jsonl, for use as "
+                             "tlisp_src")
+    parser.add_argument("--version",
+                        help="extract an older API version for tlisp_versions: "
+                             "write function_list-VERSION.txt and the pages "
+                             "to a VERSION subdirectory of the output "
+                             "directory")
+    args = parser.parse_args(argv)
+    function_list, function_db, output_dir = version_paths(args.version,
+                                                           args.output_dir)
+
+    old = read_functions(function_list)
+    symbols = parse_log(args.logfile, function_list)
+    new = read_functions(function_list)
+    added, removed, changed = diff_functions(old, new)
+    report("Added", added)
+    report("Removed", removed)
+    report("Changed", changed)
+    print("%d functions: %d added, %d removed, %d changed" % (
+        len(new), len(added), len(removed), len(changed)))
+
+    if args.format == "jsonl" and (added or removed or changed or
+                                   not os.path.isfile(function_db)):
+        count = write_database(parse_function_list(function_list), function_db)
+        print("Wrote %d functions to %s" % (count, function_db))
+
+    builtins = symbols.get('builtin')
+    if not builtins:
+        sys.exit("No builtin functions in the ;Symbol List of %s, no pages "
+                 "written" % args.logfile)
+    os.makedirs(output_dir, exist_ok=True)
+    names = []
+    for name in builtins:
+        if name in func_map or alphanum_re.match(name):
+            names.append(name)
         else:
             print (name)
-        
+
+    if args.shard == "none":
+        pages = {}
+        for name in names:
+            text = format_heading(1, name)
+            text += format_directive("(%s)"%name)
+            pages[func_map.get(name, name)] = text
+    elif args.shard == "prefix":
+        shards = shard_by_prefix(names)
+        titles = dict((key, "%s Functions" % key) for key in shards)
+        titles.update(core="Core Functions", operators="Operators")
+    else:
+        shards = shard_by_size(names, args.shard_size)
+        titles = dict((key, "Functions %s to %s" % (v[0], v[-1]))
+                      for key, v in shards.items())
+    if args.shard != "none":
+        pages = dict((key, format_shard(titles[key], group))
+                     for key, group in shards.items())
+    if args.version:
+        pages = dict((name, ".. tl:version:: %s\n\n%s" % (args.version, text))
+                     for name, text in pages.items())
+        if write_file(output_dir, "index", format_version_index(args.version)):
+            print("Add %s to a toctree, and (%r, %r) to tlisp_versions" % (
+                os.path.join(output_dir, "index"), args.version,
+                function_list))
+
+    written = [name for name, text in sorted(pages.items())
+               if write_file(output_dir, name, text)]
+    stale = remove_stale(output_dir, pages)
+    report("Removed pages", stale)
+    print("%d pages: %d written, %d removed" % (len(pages), len(written),
+                                                len(stale)))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the sphinxtlisp function list pipeline.
+
+    python -m bench.generate 10000 -o function_list_10k.txt
+    python -m bench.run --sizes 1000 10000 -o results.jsonl
+    python -m bench.run --sizes 1000 --compare results.jsonl
+"""
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Generate synthetic TLisp function lists in the style of function_list.txt
+
+Entries use the usual prefixes (obj, sys, itm...), optional arguments,
+parameter sections, returns, flag tables, examples, notes, 'literals and
+references to other generated functions, in the proportions of the real
+list.
+"""
+import sys
+import random
+import argparse
+
+PREFIXES = ['obj', 'sys', 'itm', 'shp', 'scr', 'msn', 'typ', 'ply', 'xml',
+            'sta', 'unv', 'fmt', 'gam', 'cnv', 'lnk', 'res']
+VERBS = ['Get', 'Get', 'Get', 'Set', 'Set', 'Add', 'Is', 'Create', 'Remove',
+         'Inc', 'Fire', 'Has', 'Find', 'Cancel', 'Enum', 'Can']
+NOUNS = ['Data', 'Name', 'Type', 'Level', 'Pos', 'Sovereign', 'Armor',
+         'Device', 'Item', 'Event', 'Property', 'Cargo', 'Shield', 'Target',
+         'Order', 'Station', 'Mission', 'Image', 'Count', 'Flag']
+ARGS = ['obj', 'item', 'type', 'attrib', 'data', 'pos', 'list', 'options',
+        'criteria', 'count', 'target', 'event', 'flags', 'value', 'unid']
+TYPES = ['string', 'list', 'integer', 'obj', 'item', 'struct', 'True/Nil']
+WORDS = ('the of object returns value if is a to for this given that by and '
+         'with when are ship station item list current player system').split()
+LITERALS = ["'enemy", "'friend", "'neutral", "'checkpoint", "'integer",
+            "'Small", "'installed", "'damaged"]
+
+
+def _sentence(rnd, names, links=True):
+    words = [rnd.choice(WORDS) for _ in range(rnd.randint(5, 14))]
+    if links and names and rnd.random() < 0.4:
+        words.insert(rnd.randint(1, len(words)), rnd.choice(names))
+    if rnd.random() < 0.2:
+        words.insert(rnd.randint(1, len(words)), rnd.choice(LITERALS))
+    words[0] = words[0].capitalize()
+    return ' '.join(words) + '.'
+
+
+def _table(rnd):
+    rows = ['   flags  Meaning']
+    for i in range(rnd.randint(3, 9)):
+        meaning = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 5)))
+        rows.append('   0x%03x  %s' % (1 << i, meaning))
+    return rows
+
+
+def generate_entry(rnd, name, names):
+    """Return the lines of one function list entry"""
+    args = rnd.sample(ARGS, rnd.randint(0, 4))
+    sig = ' '.join([name] + args[:-1] +
+                   (['[%s]' % args[-1]] if args and rnd.random() < 0.3
+                    else args[-1:]))
+    lines = ['(%s) -> %s' % (sig, rnd.choice(TYPES + ['result', 'True/Nil']))]
+    if rnd.random() < 0.35:
+        # Many real entries are a bare signature
+        return lines
+    lines.append('')
+    lines.append(' '.join(_sentence(rnd, names)
+                          for _ in range(rnd.randint(1, 3))))
+    lines.append('')
+    for arg in args:
+        if rnd.random() < 0.5:
+            lines.append('%s : %s' % (arg, rnd.choice(TYPES)))
+            lines.append('  ' + _sentence(rnd, names))
+    if rnd.random() < 0.3:
+        lines.append('returns:')
+        lines.append('  ' + _sentence(rnd, names, links=False))
+    if rnd.random() < 0.15:
+        lines.append('')
+        lines.append('The flags argument has the following meanings:')
+        lines.extend(_table(rnd))
+    if rnd.random() < 0.1:
+        lines.append('')
+        lines.append('Example:')
+        lines.append('  >>> (%s 1 2)' % name)
+    if rnd.random() < 0.1:
+        lines.append('')
+        lines.append('Note:')
+        lines.append('  ' + _sentence(rnd, names))
+    lines.append('')
+    return lines
+
+
+def generate_names(rnd, count):
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = rnd.choice(PREFIXES) + rnd.choice(VERBS) + rnd.choice(NOUNS)
+        if name in seen:
+            name += str(len(names))
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def generate_function_list(count, seed=0):
+    """Return the text of a synthetic function list with *count* entries"""
+    rnd = random.Random(seed)
+    names = generate_names(rnd, count)
+    lines = []
+    for name in sorted(names, key=str.lower):
+        lines.extend(generate_entry(rnd, name, names))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('count', type=int, help='number of functions')
+    parser.add_argument('-o', '--output', help='output file (default stdout)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    text = generate_function_list(args.count, args.seed)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text)
+    else:
+        sys.stdout.write(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Time the stages of the TLisp function list pipeline on synthetic input
+
+Each stage is timed (best of --repeat runs) and then run once more under
+tracemalloc for its peak memory and the memory it leaves allocated, e.g.
+the converted functions held by the catalog, per function. Results are
+JSON lines, one per stage and size, and can be compared against an earlier
+results file to catch regressions.
+
+The memory a stage leaves allocated per function is also checked against
+MEMORY_TARGETS, at every size run (by default up to 100000 functions), and
+the run fails if a target is exceeded.
+"""
+import os
+import os.path
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sphinx
+from sphinx.ext.napoleon import Config
+
+from sphinxtlisp.tlisp import TLispDocstring, parse_function_list, \
+    load_function_database, napoleon_config
+from sphinxtlisp.database import write_database
+from sphinxtlisp.quickref import QuickReference
+from bench.generate import generate_function_list, _table
+
+GLOBS = ['sys*', 'obj*Data', '*Type*', '*get*name*']
+
+# Bytes per function a stage may leave allocated: the catalog as parsed or
+# loaded, and with its converted functions
+MEMORY_TARGETS = {
+    'parse': 2048,
+    'database': 1024,
+    'convert': 1024,
+}
+
+
+# The napoleon settings of source/conf.py
+CONFIG = napoleon_config(os.path.join(ROOT, 'source'))
+
+
+def _app():
+    return SimpleNamespace(config=CONFIG)
+
+
+def _fresh(path):
+    return parse_function_list(path, _app())
+
+
+def stage_parse(path, size):
+    app = _app()
+    return lambda: parse_function_list(path, app)
+
+
+def stage_database(path, size):
+    db = os.path.splitext(path)[0] + '.jsonl'
+    if not os.path.exists(db):
+        write_database(_fresh(path), db)
+    app = _app()
+    return lambda: load_function_database(db, app)
+
+
+def stage_convert(path, size):
+    return _fresh(path).convert_all
+
+
+def stage_parse_extra(path, size):
+    # A single long section of prose and flag tables
+    rnd = random.Random(size)
+    lines = []
+    while len(lines) < size:
+        lines.append('The flags argument has the following meanings:')
+        lines.extend(_table(rnd))
+    doc = TLispDocstring('', _app().config)
+    return lambda: doc._parse_extra(list(lines))
+
+
+def stage_glob(path, size):
+    catalog = _fresh(path)
+    catalog.match('x')      # build the index outside the timing
+    # 100 rounds of queries so the timing is well above timer resolution
+    return lambda: [catalog.match(pattern) for _ in range(100)
+                    for pattern in GLOBS]
+
+
+def stage_quickref(path, size):
+    # Parse, convert and render the single file HTML and text references
+    def render():
+        reference = QuickReference(_fresh(path))
+        return [reference.render(fmt) for fmt in ('html', 'text')]
+    return render
+
+
+def stage_sphinx(path, size):
+    from sphinx.application import Sphinx
+    import apidoc
+
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+    src = os.path.join(tmp, 'source')
+    os.makedirs(os.path.join(src, 'autogen'))
+    with open(os.path.join(src, 'conf.py'), 'w') as fh:
+        fh.write('import sys\nsys.path.insert(0, %r)\n' % ROOT)
+        fh.write("extensions = ['sphinxtlisp', 'sphinx.ext.autodoc',"
+                 " 'sphinx.ext.autosummary']\n")
+        for name in sorted(Config._config_values):
+            fh.write('%s = %r\n' % (name, getattr(CONFIG, name)))
+        fh.write('tlisp_src = %r\ntlisp_cache = False\n' % path)
+        fh.write("master_doc = 'index'\n")
+    with open(os.path.join(src, 'index.rst'), 'w') as fh:
+        fh.write(apidoc.format_heading(1, 'Benchmark'))
+        fh.write('.. toctree::\n   :glob:\n\n   autogen/*\n')
+    for name in _fresh(path):
+        apidoc.write_file(os.path.join(src, 'autogen'), name,
+                          apidoc.format_heading(1, name) +
+                          apidoc.format_directive('(%s)' % name))
+
+    def build():
+        out = os.path.join(tmp, 'build')
+        shutil.rmtree(out, ignore_errors=True)
+        app = Sphinx(src, src, os.path.join(out, 'html'),
+                     os.path.join(out, 'doctrees'), 'html', status=None,
+                     warning=io.StringIO(), freshenv=True)
+        app.build()
+    return build
+
+STAGES = [
+    ('parse', stage_parse),
+    ('database', stage_database),
+    ('convert', stage_convert),
+    ('parse_extra', stage_parse_extra),
+    ('glob', stage_glob),
+    ('quickref', stage_quickref),
+    ('sphinx', stage_sphinx),
+]
+
+
+def measure(stage, path, size, repeat):
+    """
+    Return (best time in seconds, peak memory in KiB, memory retained per
+    function in bytes) for a stage
+    """
+    best = None
+    for _ in range(repeat):
+        run = stage(path, size)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    run = stage(path, size)
+    tracemalloc.start()
+    try:
+        result = run()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return best, peak // 1024, retained // size
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous, threshold):
+    """Print old and new timings side by side, returning the regressions"""
+    old = {}
+    with open(previous) as fh:
+        for line in fh:
+            record = json.loads(line)
+            old[record['stage'], record['size']] = record
+    regressions = []
+    print('%-12s %8s %10s %10s %7s' % ('stage', 'size', 'old (s)', 'new (s)',
+                                       'ratio'))
+    for record in results:
+        key = record['stage'], record['size']
+        if key not in old:
+            continue
+        ratio = record['seconds'] / max(old[key]['seconds'], 1e-9)
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('%-12s %8d %10.4f %10.4f %7.2f%s' % (
+            key[0], key[1], old[key]['seconds'], record['seconds'], ratio,
+            flag))
+    return regressions
+
+
+def check_memory(results, targets):
+    """Print the stages over their memory target, returning them"""
+    over = []
+    for record in results:
+        target = targets.get(record['stage'])
+        if target is not None and record['bytes_per_function'] > target:
+            over.append((record['stage'], record['size']))
+            print('%-12s %8d %8d B/function over the target of %d' % (
+                record['stage'], record['size'],
+                record['bytes_per_function'], target))
+    return over
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--stages', nargs='+',
+                        choices=[name for name, _s in STAGES],
+                        default=['parse', 'database', 'convert',
+                                 'parse_extra', 'glob', 'quickref'],
+                        help='stages to run; sphinx is a full HTML build '
+                             'and is not run by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output',
+                        help='append results to this JSON lines file')
+    parser.add_argument('--compare', help='earlier results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown counted as a regression (0.2 = 20%%)')
+    parser.add_argument('--no-memory-check', action='store_true',
+                        help='do not fail on stages over their memory per '
+                             'function target')
+    args = parser.parse_args(argv)
+
+    stages = dict(STAGES)
+    common = {
+        'python': platform.python_version(),
+        'sphinx': sphinx.__display_version__,
+        'commit': _commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='tlispbench')
+    try:
+        for size in args.sizes:
+            path = os.path.join(tmpdir, 'function_list_%d.txt' % size)
+            with open(path, 'w') as fh:
+                fh.write(generate_function_list(size, args.seed))
+            for name in args.stages:
+                seconds, peak, retained = measure(stages[name], path, size,
+                                                  args.repeat)
+                record = dict(common, stage=name, size=size,
+                              seconds=round(seconds, 6), peak_kib=peak,
+                              bytes_per_function=retained)
+                results.append(record)
+                print('%-12s %8d %10.4fs %10d KiB %8d B/function' % (
+                    name, size, seconds, peak, retained))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'a') as fh:
+            for record in results:
+                fh.write(json.dumps(record, sort_keys=True) + '\n')
+    failed = False
+    if args.compare:
+        failed = bool(compare(results, args.compare, args.threshold))
+    if not args.no_memory_check:
+        failed = bool(check_memory(results, MEMORY_TARGETS)) or failed
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
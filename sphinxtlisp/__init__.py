@@ -4,15 +4,23 @@
 A Sphinx extension to document Transcendence
 """
 
+__version__ = '0.6'
+
 from six import PY2, iteritems
 
 from sphinx import addnodes
 from sphinx.ext.napoleon import Config
 
 from .domain import TLispDomain
-from .nodes import tlisp_parameterlist, tlisp_parameter
-from .autodoc import TLispDocumenter, TLispAutoDirective
-from .tlisp import initialize
+from .nodes import tlisp_parameterlist, tlisp_parameter, tlisp_optional
+from .autodoc import TLispDocumenter, TLispAutoDirective, \
+    TLispDocstringDirective
+from .store import initialize, preload, finalize
+from .incremental import init_env, collect_xrefs, purge_doc, merge_info, \
+    get_outdated
+from .search import add_static_path, add_search_script, write_search_index
+from .fragments import init_fragments, merge_fragments, save_fragments
+from .profile import start_profile, write_profile
 from .writer import *
 from .autosummary import TLispSummary
 
@@ -28,14 +36,47 @@ def setup(app):
                  latex=(visit_latex_parameter, depart_latex_parameter),
                  texinfo=(visit_texinfo_parameter, noop),
                  text=(visit_text_parameter, noop))
+    app.add_node(tlisp_optional,
+                 html=(visit_html_optional, depart_html_optional),
+                 latex=(visit_latex_optional, depart_latex_optional),
+                 texinfo=(visit_texinfo_optional, depart_texinfo_optional),
+                 text=(visit_text_optional, depart_text_optional))
 
     app.add_autodocumenter(TLispDocumenter)
 
     for name, (default, rebuild) in iteritems(Config._config_values):
         app.add_config_value(name, default, rebuild)
 
-    TLispDomain.directives.update(autodoc=TLispAutoDirective)
+    TLispDomain.directives.update(autodoc=TLispAutoDirective,
+                                  docstring=TLispDocstringDirective)
+    app.connect('builder-inited', start_profile)
     app.connect('builder-inited', initialize)
+    app.connect('builder-inited', init_env)
+    app.connect('builder-inited', init_fragments)
+    app.connect('builder-inited', add_static_path)
+    app.connect('env-get-outdated', get_outdated)
+    app.connect('env-before-read-docs', preload)
+    app.connect('env-purge-doc', purge_doc)
+    app.connect('env-merge-info', merge_info)
+    app.connect('env-merge-info', merge_fragments)
+    app.connect('doctree-read', collect_xrefs)
+    app.connect('html-page-context', add_search_script)
+    app.connect('env-updated', write_search_index)
+    app.connect('env-updated', finalize)
+    app.connect('env-updated', save_fragments)
+    app.connect('build-finished', write_profile)
     app.add_config_value('tlisp_src', 'function_list.txt', True)
+    app.add_config_value('tlisp_versions', [], True)
+    app.add_config_value('tlisp_cache', True, '')
+    app.add_config_value('tlisp_fragment_cache', True, '')
+    app.add_config_value('tlisp_workers', 1, '')
+    app.add_config_value('tlisp_search_index', True, 'html')
+    app.add_config_value('tlisp_profile', None, '', types=[str, bool])
 
     app.add_directive('tlispsummary', TLispSummary)
+
+    return {
+        'version': __version__,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
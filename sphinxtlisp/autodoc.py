@@ -8,16 +8,48 @@
     twp methods:
         TLispDocumenter provides an autodoc Documenter for TLisp
         TLispAutoDirective adds an autodoc directive to the TLispDomain
+    TLispDocstringDirective inserts a docstring from the fragment store.
 """
 import re
 import traceback
 import warnings
+from contextlib import contextmanager
 
-from docutils.parsers.rst import Directive
-from docutils.statemachine import string2lines
+from docutils import nodes
+from docutils.parsers.rst import Directive, directives
+from docutils.statemachine import ViewList, StateMachine
+from sphinx import addnodes
 from sphinx.ext.autodoc import Documenter, AutoDirective, logger
+from sphinx.util.docstrings import prepare_docstring
 
-from .domain import tlisp_sig_re
+from .signature import TLispSignature
+from .incremental import note_function
+from .store import get_store, get_catalog
+from .fragments import FragmentStore, fragment_digest, parse_context, \
+    is_self_contained
+from . import profile
+
+try:
+    from sphinx.util.docutils import switch_source_input
+except ImportError:
+    # Sphinx < 1.7
+    @contextmanager
+    def switch_source_input(state, content):
+        """Report messages of a nested parse of *content* at its source"""
+        # autotlisp output is parsed with the reporter wrapped in an
+        # AutodocReporter mapping lines to the autodoc input; bypass it
+        reporter = state.memo.reporter
+        inner = getattr(reporter, 'reporter', reporter)
+        get_source_and_line = inner.get_source_and_line
+        state_machine = StateMachine([], None)
+        state_machine.input_lines = content
+        state.memo.reporter = inner
+        inner.get_source_and_line = state_machine.get_source_and_line
+        try:
+            yield
+        finally:
+            inner.get_source_and_line = get_source_and_line
+            state.memo.reporter = reporter
 
 
 
@@ -45,20 +77,21 @@ class TLispDocumenter(Documenter):
         # first, parse the definition -- auto directives for classes and
         # functions can contain a signature which is then used instead of
         # an autogenerated one
-        try:
-            name, args, retann = tlisp_sig_re.match(self.name).groups()
-        except AttributeError:
+        signature = TLispSignature.parse(self.name)
+        if signature is not None:
+            name = signature.name
+            self.args = signature.arglist
+            self.retann = signature.retann
+        else:
             # Called from autosummary we get a full python  module::name
             # note - not working yet!
             name = self.name.split('::')[-1]
-            args = None
-            retann = None
+            self.args = None
+            self.retann = None
             self.name = "(%s)" % name
             #self.directive.warn('invalid signature for auto%s (%r)' %
             #                    (self.objtype, self.name))
             #return False
-        self.args = args
-        self.retann = retann
         self.fullname = (name or '')
         self.modname = '' #'tlisp'
         self.objpath = name,
@@ -73,9 +106,10 @@ class TLispDocumenter(Documenter):
         try:
             logger.debug('[autodoc] TLisp %s', self.fullname)
             # Get environment
-            tlispfuncs = self.env.config._tlispfuncs
+            tlispfuncs = get_catalog(self.env)
             if tlispfuncs is None:
                 raise Exception("No TLisp function list")
+            note_function(self.env, self.fullname)
             obj =  tlispfuncs[self.fullname.lower()]
             self.object = obj
             self.args = obj.args
@@ -104,6 +138,27 @@ class TLispDocumenter(Documenter):
     def format_signature(self):
         return self.object.tlisp_signature
 
+    def get_doc(self, encoding=None, ignore=1):
+        # The catalog record holds the converted docstring
+        return [prepare_docstring(self.object.doc, ignore)]
+
+    def add_content(self, more_content, no_docstring=False):
+        # Insert the docstring through tl:docstring so its parsed nodes are
+        # shared, unless another extension wants to process it
+        if self.env.app.events.listeners.get('autodoc-process-docstring'):
+            return Documenter.add_content(self, more_content, no_docstring)
+        sourcename = self.get_sourcename()
+        if not no_docstring:
+            self.add_line(u'.. tl:docstring:: ' + self.fullname, sourcename)
+            self.add_line(u'', sourcename)
+        if more_content:
+            for line, src in zip(more_content.data, more_content.items):
+                self.add_line(line, src[0], src[1])
+
+    def generate(self, *args, **kwargs):
+        with profile.phase(self.env, 'autotlisp'):
+            Documenter.generate(self, *args, **kwargs)
+
 
 class TLispAutoDirective(Directive):
     """
@@ -115,15 +170,18 @@ class TLispAutoDirective(Directive):
     required_arguments = 1
     optional_arguments = 0
     final_argument_whitespace = True
-    # allow any options to be passed; the options are parsed further
-    # by the selected Documenter
-    option_spec = {}
+    option_spec = {'noindex': directives.flag}
 
     def warn(self, msg):
         # type: (unicode) -> None
         self.warnings.append(self.reporter.warning(msg, line=self.lineno))    
 
     def run(self):
+        env = self.state.document.settings.env
+        with profile.phase(env, 'autotlisp'):
+            return self._run()
+
+    def _run(self):
         self.reporter = self.state.document.reporter
         self.env = self.state.document.settings.env
         self.warnings = [] # type: List[unicode]
@@ -136,21 +194,91 @@ class TLispAutoDirective(Directive):
                      source, lineno, self.block_text)
 
         # Get environment
-        tlispfuncs = self.env.config._tlispfuncs
+        tlispfuncs = get_catalog(self.env)
         if tlispfuncs is None:
             return []
 
         # Look for the requested object
         objname = self.arguments[0].lower()
-        
-        if objname not in tlispfuncs.functions:
-            self.state_machine.reporter.warning('Unknown function name: %s'%objname, line=self.lineno)
+        note_function(self.env, objname)
+
+        if objname not in tlispfuncs:
+            self.warn('Unknown function name: %s' % objname)
+            return self.warnings
 
-        obj = tlispfuncs.functions[objname]
+        obj = tlispfuncs[objname]
         source = self.state_machine.input_lines.source(
             self.lineno - self.state_machine.input_offset - 1)
 
-        include_lines = [obj.tlisp_signature] + string2lines(obj.__doc__, convert_whitespace=1)
-        self.state_machine.insert_input(include_lines,source)
+        # The docstring itself is inserted by tl:docstring from a cached
+        # node tree, so only the signature and any content are parsed here
+        include_lines = ['.. tl:function:: ' + obj.tlisp_signature]
+        if 'noindex' in self.options:
+            include_lines.append('   :noindex:')
+        include_lines.extend(['', '   .. tl:docstring:: ' + objname, ''])
+        include_lines.extend('   ' + line for line in self.content)
+        self.state_machine.insert_input(include_lines, source)
 
         return []
+
+
+class TLispDocstringDirective(Directive):
+    """
+    Insert the docstring of a TLisp function.
+
+    The docstring is parsed into a node tree the first time it is used and,
+    if the tree is self-contained, it is kept in the fragment store; later
+    uses, in this or later builds, get a copy. Other trees, e.g. those with
+    warnings, are parsed again each time.
+    """
+
+    has_content = False
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = False
+    option_spec = {}
+
+    def run(self):
+        env = self.state.document.settings.env
+        tlispfuncs = get_catalog(env)
+        objname = self.arguments[0].lower()
+        if tlispfuncs is None or objname not in tlispfuncs:
+            return [self.state.document.reporter.warning(
+                'Unknown function name: %s' % objname, line=self.lineno)]
+        note_function(env, objname)
+
+        # Reuse the nodes of the docstring parsed in this or an earlier
+        # build, possibly for another version
+        obj = tlispfuncs[objname]
+        sourcename = '%s:docstring of %s' % (env.config.tlisp_src, obj.name)
+        digest = fragment_digest(obj.doc, sourcename, parse_context(env))
+        fingerprint = tlispfuncs.fingerprints()[objname]
+        result = get_store(env).fragments.get(digest, env.tlisp_fragments)
+        if result is None:
+            with profile.phase(env, 'docstring parse'):
+                result = self.parse_docstring(obj, sourcename)
+            if is_self_contained(result):
+                env.tlisp_fragments[digest] = (fingerprint,
+                                               FragmentStore.dump(result))
+        else:
+            env.tlisp_fragments_used[digest] = fingerprint
+            profile.count(env, 'docstrings reused')
+
+        # The nodes may have been parsed for another version
+        for node in result:
+            for xref in node.traverse(addnodes.pending_xref):
+                xref['refdoc'] = env.docname
+                xref['tl:version'] = env.temp_data.get('tl:version')
+        return result
+
+    def parse_docstring(self, obj, sourcename):
+        """Parse the converted docstring of *obj* into a list of nodes"""
+        content = ViewList()
+        for i, line in enumerate(prepare_docstring(obj.doc)):
+            content.append(line, sourcename, i)
+
+        with switch_source_input(self.state, content):
+            node = nodes.paragraph()
+            node.document = self.state.document
+            self.state.nested_parse(content, 0, node)
+        return node.children
@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 
-import re
-
 from sphinx.ext.autosummary import Autosummary
 
+from .incremental import note_function, note_pattern
+from .index import is_pattern
+from .store import get_catalog
+from . import profile
+
 class TLispSummary(Autosummary):
-    
+
+    def run(self):
+        # Autosummary.run only passes on rows starting with a letter, so keep
+        # our own copy to allow leading wildcards such as *Type*
+        self.tlisp_names = [x.strip().split()[0] for x in self.content
+                            if x.strip()]
+        with profile.phase(self.state.document.settings.env, 'summary'):
+            return Autosummary.run(self)
+
     def get_items(self, names):
         # type: (List[unicode]) -> List[Tuple[unicode, unicode, unicode, unicode]]
         """Try to import the given names, and return a list of
@@ -17,33 +28,18 @@ class TLispSummary(Autosummary):
 
         max_item_chars = 50
 
-        tlispfuncs = self.env.config._tlispfuncs
+        tlispfuncs = get_catalog(env)
         fncnames = []
-        # Autoexpand any names if required
-        for name in names:
-            if name.endswith('*'):
-                fncnames.extend([n for n in tlispfuncs if n.startswith(name[:-1].lower())])
+        # Autoexpand any wildcard names (sys*, obj*Data, *Type*)
+        for name in getattr(self, 'tlisp_names', names):
+            if is_pattern(name):
+                note_pattern(env, name)
+                fncnames.extend(tlispfuncs.match(name))
             else:
                 fncnames.append(name)
         for name in fncnames:
+            note_function(env, name)
             obj =  tlispfuncs[name.lower()]
-            doc = list(obj.lines())
-            while doc and not doc[0].strip():
-                doc.pop(0)
-
-            for i, piece in enumerate(doc):
-                if not piece.strip():
-                    doc = doc[:i]
-                    break
-            # Try to find the "first sentence", which may span multiple lines
-            m = re.search(r"^([A-Z].*?\.)(?:\s|$)", " ".join(doc).strip())
-            if m:
-                summary = m.group(1).strip()
-            elif doc:
-                summary = doc[0].strip()
-            else:
-                summary = ''
-
-            items.append((obj.tlisp_signature, '', summary, name))
+            items.append((obj.tlisp_signature, '', obj.summary, name))
         
         return items
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.cache
+    ~~~~~~~~~~~~~~~~~
+
+    Persistent on-disk cache of the converted TLisp function list.
+
+    The cache lives in the doctree directory and is keyed on the SHA-1 of the
+    function list, the extension version and the napoleon settings used for
+    conversion. If any of these change the stored catalog is ignored and
+    rewritten on the next build. Set ``tlisp_cache = False`` to bypass it, or
+    simply delete the cache file to force a re-parse.
+"""
+import os
+import os.path
+import hashlib
+
+from six.moves import cPickle as pickle
+
+from sphinx.ext.napoleon import Config
+
+from . import __version__
+
+CACHE_FILE = 'tlisp-catalog.pickle'
+
+
+def cache_path(app):
+    """Return the location of the catalog cache for *app*."""
+    return os.path.join(app.doctreedir, CACHE_FILE)
+
+
+def conversion_key(config):
+    """
+    Return the key of everything besides the function list that changes how
+    a docstring is converted: the extension version and napoleon settings.
+    """
+    h = hashlib.sha1(__version__.encode('ascii'))
+    for name in sorted(Config._config_values):
+        h.update(('%s=%r' % (name, getattr(config, name, None))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def catalog_key(fnc_file, config):
+    """
+    Return the key identifying a converted catalog: the digest of the function
+    list plus everything else that changes how it is converted.
+    """
+    h = hashlib.sha1()
+    with open(fnc_file, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 16), b''):
+            h.update(block)
+    h.update(conversion_key(config).encode('ascii'))
+    return h.hexdigest()
+
+
+def load_catalog(path, key):
+    """Return the cached catalog stored at *path*, or None if it is stale."""
+    try:
+        with open(path, 'rb') as fh:
+            stored_key, catalog = pickle.load(fh)
+    except Exception:
+        # Missing, truncated or written by an incompatible version
+        return None
+    if stored_key != key:
+        return None
+    return catalog
+
+
+def save_catalog(path, key, catalog):
+    """Store *catalog* at *path* under *key*, replacing any previous cache."""
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        pickle.dump((key, catalog), fh, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.database
+    ~~~~~~~~~~~~~~~~~~~~
+
+    The function list as a JSON lines database.
+
+    Each line of ``function_list.jsonl`` is one function record with the
+    signature already split::
+
+        {"name": ..., "args": ..., "retann": ..., "sig": ..., "doc": ...}
+
+    and ``function_list.jsonl.idx`` holds the offset, length and fingerprint
+    of every record in catalog order. Loading a database only reads the
+    index; the file is memory mapped and a record is decoded when its
+    function is first looked up. Set ``tlisp_src`` to the ``.jsonl`` file to
+    use it. If the index is missing or does not match the size and
+    modification time of the database it is rebuilt by scanning the records.
+"""
+import os
+import os.path
+import sys
+import json
+import mmap
+import argparse
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from .tlisp import TLispCatalog, parse_function_list
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 2
+
+
+def write_database(catalog, path):
+    """
+    Write the functions of a parsed *catalog* to the database *path* and
+    its index. Returns the number of functions written.
+    """
+    fingerprints = catalog.fingerprints()
+    index = []
+    with open(path, 'wb') as fh:
+        for key, (sig, doc) in catalog.raw_items():
+            signature = catalog.signature(key)
+            record = json.dumps(OrderedDict([
+                ('name', signature.name), ('args', signature.arglist),
+                ('retann', signature.retann or ''),
+                ('sig', sig), ('doc', doc)])).encode('utf-8') + b'\n'
+            index.append([key, fh.tell(), len(record), fingerprints[key]])
+            fh.write(record)
+        size = fh.tell()
+    _write_index(path, size, index)
+    return len(index)
+
+
+def _write_index(path, size, index):
+    # The modification time tells a database rewritten at the same size
+    with open(path + INDEX_SUFFIX, 'w') as fh:
+        json.dump({'version': INDEX_VERSION, 'size': size,
+                   'mtime': os.stat(path).st_mtime_ns,
+                   'functions': index}, fh, separators=(',', ':'))
+
+
+class FunctionDatabase(Mapping):
+    """
+    Read-only mapping of lower case function name to (signature, docstring),
+    backed by a memory mapped database file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._mm = None
+        self._offsets = OrderedDict()  # type: Dict[unicode, Tuple[int, int]]
+        self.fingerprints = {}         # type: Dict[unicode, str]
+        if not self._read_index():
+            print("[tlisp] Rebuilding index for", path)
+            self._scan()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        return state
+
+    def _open(self):
+        with open(self.path, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                # An empty file can't be mapped, and has no records anyway
+                self._mm = b''
+            else:
+                self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_index(self):
+        try:
+            with open(self.path + INDEX_SUFFIX) as fh:
+                index = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return False
+        st = os.stat(self.path)
+        if (index.get('version') != INDEX_VERSION or
+                index.get('size') != st.st_size or
+                index.get('mtime') != st.st_mtime_ns):
+            return False
+        for key, offset, length, fingerprint in index['functions']:
+            self._offsets[key] = (offset, length)
+            self.fingerprints[key] = fingerprint
+        return True
+
+    def _scan(self):
+        catalog = TLispCatalog()
+        index = []
+        offset = 0
+        with open(self.path, 'rb') as fh:
+            for line in fh:
+                record = json.loads(line.decode('utf-8'))
+                key = record['name'].lower()
+                catalog.add(record['sig'], record['doc'])
+                self._offsets[key] = (offset, len(line))
+                index.append([key, offset, len(line)])
+                offset += len(line)
+        self.fingerprints = catalog.fingerprints()
+        try:
+            _write_index(self.path, offset,
+                         [entry + [self.fingerprints[entry[0]]]
+                          for entry in index])
+        except (IOError, OSError):
+            pass
+
+    def record(self, name):
+        """Return the full database record of a function"""
+        offset, length = self._offsets[name]
+        if self._mm is None:
+            self._open()
+        return json.loads(self._mm[offset:offset + length].decode('utf-8'))
+
+    def __getitem__(self, name):
+        record = self.record(name)
+        return record['sig'], record['doc']
+
+    def __contains__(self, name):
+        return name in self._offsets
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sphinxtlisp.database',
+        description='Convert a function list to a function database')
+    parser.add_argument('function_list', help='function_list.txt to convert')
+    parser.add_argument('-o', '--output',
+                        help='database file (default: function list name '
+                             'with a .jsonl extension)')
+    args = parser.parse_args(argv)
+    output = args.output or os.path.splitext(args.function_list)[0] + '.jsonl'
+    count = write_database(parse_function_list(args.function_list), output)
+    print("Wrote %d functions to %s" % (count, output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
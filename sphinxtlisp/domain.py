@@ -7,7 +7,9 @@
 
 """
 import re
+import json
 
+from docutils import nodes
 from docutils.parsers.rst import Directive, directives
 
 from sphinx import addnodes
@@ -16,19 +18,26 @@ from sphinx.locale import l_, _
 from sphinx.domains import Domain, ObjType
 from sphinx.domains.python import PyModulelevel
 from sphinx.directives import ObjectDescription
+from sphinx.util import logging
 from sphinx.util.nodes import make_refnode
 from sphinx.util.docfields import Field, GroupedField, TypedField
 
-from .nodes import tlisp_parameterlist, tlisp_parameter
+from .nodes import tlisp_parameterlist, tlisp_parameter, tlisp_optional
+from .signature import TLispSignature, tlisp_sig_re, OPTIONAL
+from .store import get_store, get_catalog
+from . import profile
 
-# REs for TLisp signatures
-tlisp_sig_re = re.compile(
-    r'''^\(([\w+-/*@!<=>]+)\s*             # symbol name
-          (?: (.*))? \)         # optional: arguments
-          (?:\s* -> \s* (.*))?  # optional: return annotation
-          $                     # and nothing more
-          ''', re.VERBOSE)
+logger = logging.getLogger(__name__)
 
+# The markup the docstring conversion adds to table cells
+_cell_markup_regex = re.compile(r'``(.+?)``|:tl:function:`([^`]+)`')
+# Characters of a version label not kept in the ids of its descriptions
+_version_id_regex = re.compile(r'[^a-z0-9_]+')
+
+
+def version_id(version):
+    """The id form of a version label: lower case, '1.0' becomes '1-0'"""
+    return _version_id_regex.sub('-', version.lower()).strip('-')
 
 
 class TLispExp(PyModulelevel): #ObjectDescription
@@ -65,15 +74,65 @@ class TLispExp(PyModulelevel): #ObjectDescription
         """
         return False
 
+    def run(self):
+        result = PyModulelevel.run(self)
+        store = get_store(self.env)
+        if self.names and store is not None and store.versions:
+            switch = self.version_links(self.names[0][0], store)
+            if switch is not None:
+                result[-1][-1].insert(0, switch)
+        return result
+
+    def version_links(self, name, store):
+        """
+        Return a paragraph linking to the descriptions of *name* in the
+        other API versions, or None if it is only in the one documented.
+        """
+        current = self.env.temp_data.get('tl:version')
+        main = self.env.config.version or 'latest'
+        versions = [(None, main, store.functions)]
+        versions.extend((label, label, catalog) for label, catalog in
+                        store.versions.items())
+        labels = [(version, label) for version, label, catalog in versions
+                  if catalog is not None and name.lower() in catalog]
+        if len(labels) < 2 or current not in [v for v, _l in labels]:
+            return None
+        para = nodes.paragraph(classes=['tlisp-versions'])
+        para += nodes.strong(_('Versions:'), _('Versions:'))
+        for version, label in labels:
+            para += nodes.Text(' ')
+            if version == current:
+                para += nodes.strong(label, label)
+                continue
+            xref = addnodes.pending_xref(
+                '', refdomain='tl', reftype='version', reftarget=name,
+                refexplicit=True, refwarn=False)
+            xref['tl:version'] = version
+            xref += nodes.inline(label, label)
+            para += xref
+        return para
+
+    def get_signature(self, sig):
+        """
+        Return the parsed *sig*, from the function catalog if it is the
+        signature of one of its functions.
+        """
+        functions = get_catalog(self.env)
+        if functions is not None:
+            signature = functions.find_signature(sig)
+            if signature is not None:
+                return signature
+        return TLispSignature.parse(sig)
+
     def handle_signature(self, sig, signode):
         """Transform a TLisp signature into RST nodes.
 
         Return (fully qualified name of the thing, classname if any).
         """
-        m = tlisp_sig_re.match(sig)
-        if m is None:
+        signature = self.get_signature(sig)
+        if signature is None:
             raise ValueError
-        name, arglist, retann = m.groups()
+        name, retann = signature.name, signature.retann
         name_prefix = None
         
         package = self.env.temp_data.get('tl:package')
@@ -90,9 +149,16 @@ class TLispExp(PyModulelevel): #ObjectDescription
         sexp = tlisp_parameterlist()
         sexp += addnodes.desc_name(name, name)
         
-        for argument in arglist.split(' '):
-            argument = argument.strip()
-            sexp += tlisp_parameter(argument, argument)
+        for argument in signature.arguments:
+            if argument.kind == OPTIONAL:
+                optional = tlisp_optional()
+                optional += tlisp_parameter(argument.name, argument.name)
+                sexp += optional
+            elif argument.name:
+                sexp += tlisp_parameter(argument.text, argument.text)
+            else:
+                sexp += tlisp_parameter(argument.text, argument.text,
+                                        noemph=True)
         
         signode += sexp
         
@@ -104,7 +170,10 @@ class TLispExp(PyModulelevel): #ObjectDescription
 
     def get_index_text(self, modname, name):
         """Return the text for the index entry of the object."""
-        if self.objtype == 'function':
+        version = self.env.temp_data.get('tl:version')
+        if self.objtype == 'function' and version:
+            return _('%s (TLisp function, %s)') % (name[0], version)
+        elif self.objtype == 'function':
             return _('%s (TLisp function)') % name[0]
         else:
             raise NotImplementedError("not a TLisp function")
@@ -112,19 +181,27 @@ class TLispExp(PyModulelevel): #ObjectDescription
 
     def add_target_and_index(self, name, sig, signode):
         # node target
-        fullname = 'tl.' + name[0].lower()
+        version = self.env.temp_data.get('tl:version')
+        if version:
+            fullname = 'tl.%s.%s' % (version_id(version),
+                                      name[0].lower())
+        else:
+            fullname = 'tl.' + name[0].lower()
         if fullname not in self.state.document.ids:
             signode['names'].append(fullname)
             signode['ids'].append(fullname)
             signode['first'] = (not self.names)
             self.state.document.note_explicit_target(signode)
-            symbols = self.env.domaindata['tl']['symbols']
+            domain = self.env.get_domain('tl')
+            symbols = domain.data['symbols']
             if fullname in symbols:
                 self.state_machine.reporter.warning(
                     'duplicate symbol description of %s, ' % fullname +
                     'other instance in ' + self.env.doc2path(symbols[fullname][0]),
                     line=self.lineno)
-            symbols[fullname] = (self.env.docname, self.objtype)
+            domain.note_symbol(fullname, name[0], self.env.docname,
+                               self.objtype,
+                               self.env.temp_data.get('tl:package'), version)
 
         indextext = self.get_index_text(None, name)
         if indextext:
@@ -152,8 +229,100 @@ class TLispCurrentPackage(Directive):
         return []
 
 
+class TLispCurrentVersion(Directive):
+    """Tell Sphinx that the rest of the document describes one of the API
+    versions in tlisp_versions rather than the current one.
+
+    """
+
+    has_content = False
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = False
+    option_spec = {}
+
+    def run(self):
+        env = self.state.document.settings.env
+        version = self.arguments[0]
+        if version == (env.config.version or 'latest'):
+            env.temp_data.pop('tl:version', None)
+            return []
+        env.temp_data['tl:version'] = version
+        store = get_store(env)
+        if store is None or version not in store.versions:
+            return [self.state.document.reporter.warning(
+                'Unknown TLisp API version: %s' % version, line=self.lineno)]
+        return []
+
+
+class TLispTable(Directive):
+    """A space separated table from the function list.
+
+    Each content line is a row, a JSON list of its cells, and the ``widths``
+    option gives the column widths. The cells are not parsed as
+    reStructuredText: they are text, except for the quoted literals and
+    function links added by the docstring conversion.
+    """
+
+    has_content = True
+    required_arguments = 0
+    optional_arguments = 0
+    option_spec = {'widths': directives.positive_int_list}
+
+    def run(self):
+        widths = self.options['widths']
+        table = nodes.table(classes=['colwidths-given'])
+        tgroup = nodes.tgroup(cols=len(widths))
+        table += tgroup
+        for width in widths:
+            tgroup += nodes.colspec(colwidth=width)
+        tbody = nodes.tbody()
+        tgroup += tbody
+        messages = []
+        for offset, line in enumerate(self.content):
+            try:
+                cells = json.loads(line)
+            except ValueError:
+                raise self.error('Invalid table row: %s' % line)
+            cells += [''] * (len(widths) - len(cells))
+            row = nodes.row()
+            for text in cells:
+                entry = nodes.entry()
+                if text:
+                    inline, msgs = self.cell_nodes(
+                        text, self.content_offset + offset + 1)
+                    entry += nodes.paragraph(text, '', *inline)
+                    messages.extend(msgs)
+                row += entry
+            tbody += row
+        return [table] + messages
+
+    def cell_nodes(self, text, lineno):
+        """Return the nodes and messages for the text of a cell"""
+        result = []
+        messages = []
+        pos = 0
+        for m in _cell_markup_regex.finditer(text):
+            if m.start() > pos:
+                result.append(nodes.Text(text[pos:m.start()]))
+            literal, target = m.groups()
+            if literal is not None:
+                result.append(nodes.literal(m.group(), literal))
+            else:
+                role = TLispDomain.roles['function']
+                xref, msgs = role('tl:function', m.group(), target, lineno,
+                                  self.state.inliner)
+                result.extend(xref)
+                messages.extend(msgs)
+            pos = m.end()
+        if pos < len(text):
+            result.append(nodes.Text(text[pos:]))
+        return result, messages
+
+
 class TLispXRefRole(XRefRole):
     def process_link(self, env, refnode, has_explicit_title, title, target):
+        refnode['tl:version'] = env.temp_data.get('tl:version')
         if not has_explicit_title:
             target = target.lstrip('~')  # only has a meaning for the title
             # if the first character is a tilde, don't display the package
@@ -178,7 +347,9 @@ class TLispDomain(Domain):
 
     directives = {
         'package': TLispCurrentPackage,
+        'version': TLispCurrentVersion,
         'function': TLispExp,
+        'table': TLispTable,
     }
 
     roles = {
@@ -186,43 +357,117 @@ class TLispDomain(Domain):
         'obj': TLispXRefRole(),
     }
     initial_data = {
-        'symbols': {},
+        'symbols': {},  # fullname -> (docname, objtype)
+        'docnames': {}, # docname -> {fullname: (name, lookup keys)}
+        'names': {},    # lookup key -> fullname, 'version/key' for versions
     }
+    data_version = 3
 
-    def clear_doc(self, docname):
-        for fullname, (fn, _l) in list(self.data['symbols'].items()):
-            if fn == docname:
-                del self.data['symbols'][fullname]
+    @staticmethod
+    def lookup_key(name):
+        """Normalise a symbol reference: strip parens, 'tl.' and case"""
+        name = name.strip('()').lower()
+        if name.startswith('tl.'):
+            name = name[3:]
+        return name
 
-    def find_obj(self, env, name):
+    def note_symbol(self, fullname, name, docname, objtype, package=None,
+                    version=None):
+        """Add a symbol described in *docname* to the symbol table"""
+        symbols = self.data['symbols']
+        if fullname in symbols:
+            # Drop the other description from the reverse index
+            self.data['docnames'].get(symbols[fullname][0], {}).pop(fullname,
+                                                                    None)
+        symbols[fullname] = (docname, objtype)
+        keys = [self.lookup_key(name)]
+        if package:
+            keys.append('%s:%s' % (package.lower(), keys[0]))
+        if version:
+            keys = ['%s/%s' % (version, key) for key in keys]
+            name = '%s/%s' % (version, name)
+        for key in keys:
+            self.data['names'][key] = fullname
+        self.data['docnames'].setdefault(docname, {})[fullname] = (name, keys)
+
+    def clear_doc(self, docname):
+        symbols = self.data['symbols']
+        names = self.data['names']
+        for fullname, (_n, keys) in self.data['docnames'].pop(docname, {}).items():
+            if symbols.get(fullname, (None,))[0] == docname:
+                del symbols[fullname]
+            for key in keys:
+                if names.get(key) == fullname:
+                    del names[key]
+
+    def merge_domaindata(self, docnames, otherdata):
+        """Merge in the symbols read by a parallel worker process"""
+        symbols = self.data['symbols']
+        for docname in docnames:
+            for fullname, entry in otherdata['docnames'].get(docname, {}).items():
+                fn, objtype = otherdata['symbols'][fullname]
+                if fn != docname:
+                    continue
+                if fullname in symbols and symbols[fullname][0] != fn:
+                    other = symbols[fullname][0]
+                    logger.warning('duplicate symbol description of %s, '
+                                   'other instance in %s', fullname,
+                                   self.env.doc2path(other), location=fn)
+                    # A serial read would have kept the last document read
+                    if other > fn:
+                        continue
+                    self.data['docnames'].get(other, {}).pop(fullname, None)
+                symbols[fullname] = (fn, objtype)
+                for key in entry[1]:
+                    self.data['names'][key] = fullname
+                self.data['docnames'].setdefault(fn, {})[fullname] = entry
+
+    def find_obj(self, env, name, version=None, exact=False):
         """Find a Lisp symbol for "name", perhaps using the given package
         Return a list of (name, object entry) tuples.
 
+        With a *version* the symbol is looked up in that API version first,
+        then in the current one unless *exact* is set.
         """
         # Case insensitive search, and strip parens
-        name = name.strip('()').lower()
+        name = self.lookup_key(name)
         if not name:
             return []
 
         symbols = self.data['symbols']
-        name = 'tl.' + name
-        # Only support exact matches for now
-        if name in symbols:
-            return [(name, symbols[name])]
+        names = self.data['names']
+        keys = [name]
+        if ':' in name:
+            # Fall back to the unqualified name
+            keys.append(name.split(':')[-1])
+        if version:
+            versioned = ['%s/%s' % (version, key) for key in keys]
+            keys = versioned if exact else versioned + keys
+        for key in keys:
+            fullname = names.get(key)
+            if fullname in symbols:
+                return [(fullname, symbols[fullname])]
+        return []
 
     def resolve_xref(self, env, fromdocname, builder,
                      typ, target, node, contnode):
-        matches = self.find_obj(env, target)
+        # Version switch links only go to the description in that version
+        with profile.phase(env, 'xref'):
+            matches = self.find_obj(env, target, node.get('tl:version'),
+                                    exact=(typ == 'version'))
         if not matches:
+            profile.count(env, 'xrefs unresolved')
             return None
         elif len(matches) > 1:
             logger.warning('more than one target found for cross-reference %r: %s',
                            target, ', '.join(match[0] for match in matches),
                            location=node)
         name, obj = matches[0]
+        profile.count(env, 'xrefs resolved')
         return make_refnode(builder, fromdocname, obj[0], name, contnode, name)
 
-    def get_symbols(self):
-        for refname, docs in self.data['symbols'].iteritems():
-            for (docname, type) in docs:
-                yield (refname, refname, type, docname, refname, 1)
+    def get_objects(self):
+        for docname, entries in self.data['docnames'].items():
+            for fullname, (name, _k) in entries.items():
+                objtype = self.data['symbols'][fullname][1]
+                yield (name, name, objtype, docname, fullname, 1)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.fragments
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Parsed docstring node trees, kept between builds.
+
+    Each function's converted docstring is parsed into docutils nodes by the
+    tl:docstring directive. The nodes are stored pickled in
+    ``tlisp-fragments.pickle``, keyed by a digest of the text, its source
+    (the function list and function name) and the parser context: the
+    roles known, the default role, the primary domain, the prolog and
+    epilog and the extensions. A later build, even with a fresh
+    environment, loads them instead of parsing again.
+
+    Only self-contained node trees are stored. A tree with system messages
+    (and the problematic nodes referring to them), ids, names or pending
+    transforms belongs to the document it was parsed in, so it is parsed
+    again wherever it is used, and its warnings are reported each time.
+    Set ``tlisp_fragment_cache`` to a path to keep the store outside the
+    build directory (e.g. in a CI cache), or to False to only share
+    fragments within one build.
+
+    Fragments parsed during a build are collected in the environment so
+    those from parallel readers are merged, and are written out when the
+    environment is updated. Each fragment is stored with the fingerprint of
+    the function it documents. When the store is written, fragments of
+    functions no longer in any catalog are dropped. So are fragments
+    superseded by those parsed or used for the same function in this build.
+    The store is discarded when the docutils, Sphinx or extension version
+    changes.
+"""
+import os
+import os.path
+import hashlib
+
+from six.moves import cPickle as pickle
+
+import docutils
+from docutils import nodes
+from docutils.parsers.rst import roles
+import sphinx
+
+from . import __version__
+
+FRAGMENT_FILE = 'tlisp-fragments.pickle'
+# Version of the store's layout
+FORMAT = 2
+
+
+def fragment_path(app):
+    """Return the fragment store path for *app*, or None if disabled"""
+    setting = app.config.tlisp_fragment_cache
+    if not setting:
+        return None
+    if setting is True:
+        return os.path.join(app.doctreedir, FRAGMENT_FILE)
+    return os.path.join(app.confdir, setting)
+
+
+def parse_context(env):
+    """
+    Return a description of everything, besides the text and its source,
+    that changes how a docstring is parsed
+    """
+    config = env.config
+    names = sorted(name for name in set(roles._roles) | set(roles._role_registry)
+                   if name)
+    default = roles._roles.get('')
+    default_names = [name for name in names if default is not None and
+                     default in (roles._roles.get(name),
+                                 roles._role_registry.get(name))]
+    return repr((names, default_names[:1], config.default_role,
+                 config.primary_domain, config.rst_prolog, config.rst_epilog,
+                 sorted(config.extensions)))
+
+
+def fragment_digest(text, *context):
+    """Return the key of the nodes parsed from *text* in *context*"""
+    h = hashlib.sha1(text.encode('utf-8'))
+    for value in context:
+        h.update(b'\0' + value.encode('utf-8'))
+    return h.hexdigest()
+
+
+def is_self_contained(nodelist):
+    """
+    True if the nodes do not depend on the document they were parsed in, so
+    they can be stored and used in another
+    """
+    for node in nodelist:
+        if not isinstance(node, nodes.Element):
+            continue
+        for subnode in node.traverse(nodes.Element):
+            if (isinstance(subnode, (nodes.system_message, nodes.pending)) or
+                    subnode['ids'] or subnode['names'] or
+                    subnode.get('refid') or subnode.get('backrefs')):
+                return False
+    return True
+
+
+class FragmentStore(object):
+    """
+    Pickled node lists keyed on the digest of their source text, each with
+    the fingerprint of the function it documents. The store file is read
+    the first time a fragment is looked up.
+    """
+    versions = (FORMAT, docutils.__version__, sphinx.__version__, __version__)
+
+    def __init__(self, path=None):
+        self.path = path
+        self._blobs = None  # type: Dict[str, Tuple[str, bytes]]
+
+    def _load(self):
+        self._blobs = {}
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'rb') as fh:
+                versions, blobs = pickle.load(fh)
+        except Exception:
+            return
+        if versions == self.versions:
+            self._blobs = blobs
+
+    def get(self, digest, new=None):
+        """
+        Return a fresh copy of the nodes stored under *digest*, looking in
+        the fragments *new* this build first, or None.
+        """
+        entry = new.get(digest) if new else None
+        if entry is None:
+            if self._blobs is None:
+                self._load()
+            entry = self._blobs.get(digest)
+        if entry is None:
+            return None
+        return pickle.loads(entry[1])
+
+    @staticmethod
+    def dump(nodelist):
+        """Pickle a copy of a list of nodes for the store"""
+        copies = [node.deepcopy() for node in nodelist]
+        for node in copies:
+            node.parent = None
+            # Don't keep the first document alive through the nodes
+            for subnode in node.traverse():
+                subnode.document = None
+        return pickle.dumps(copies, pickle.HIGHEST_PROTOCOL)
+
+    def save(self, new, used, live):
+        """
+        Add the *new* fragments and write the store. Fragments whose
+        function fingerprint is not in *live* are dropped, as are those of
+        a function with fragments in *new* or *used* ({digest: fingerprint}
+        of the fragments reused this build) that are in neither.
+        """
+        if self.path is None or not new:
+            return
+        if self._blobs is None:
+            self._load()
+        self._blobs.update(new)
+        current = {}
+        for digest, owner in used.items():
+            current.setdefault(owner, set()).add(digest)
+        for digest, (owner, _blob) in new.items():
+            current.setdefault(owner, set()).add(digest)
+        self._blobs = dict(
+            (digest, (owner, blob))
+            for digest, (owner, blob) in self._blobs.items()
+            if owner in live and digest in current.get(owner, (digest,)))
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as fh:
+                pickle.dump((self.versions, self._blobs), fh,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except (IOError, OSError) as err:
+            print("[tlisp] Could not write fragment store", self.path, err)
+
+
+def init_fragments(app):
+    env = app.builder.env
+    # digest -> (fingerprint, pickled nodes), parsed this build
+    env.tlisp_fragments = {}
+    # digest -> fingerprint, reused from the store this build
+    env.tlisp_fragments_used = {}
+
+
+def merge_fragments(app, env, docnames, other):
+    env.tlisp_fragments.update(other.tlisp_fragments)
+    env.tlisp_fragments_used.update(other.tlisp_fragments_used)
+
+
+def save_fragments(app, env):
+    if env.tlisp_fragments:
+        live = set(app.tlisp.fingerprints().values())
+        app.tlisp.fragments.save(env.tlisp_fragments,
+                                 env.tlisp_fragments_used, live)
+    env.tlisp_fragments = {}
+    env.tlisp_fragments_used = {}
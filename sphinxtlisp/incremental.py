@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.incremental
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Track which documents use which TLisp functions, so that editing the
+    function list only re-reads the documents that are actually affected.
+
+    The environment records, per document, the functions it renders
+    (autotlisp, tlispsummary), the tlispsummary wildcards it expands and the
+    functions it cross-references, plus the key of the function lists as of
+    the last read. The fingerprint of every function at that time is saved
+    next to the doctrees, keyed the same way, so the environment does not
+    grow with the function list. The key of the extension version and
+    napoleon settings is saved with them; when it changes every document
+    rendering TLisp functions is outdated. Functions of the other API versions in
+    tlisp_versions are tracked as 'version/name'.
+"""
+from fnmatch import fnmatchcase
+
+from sphinx import addnodes
+
+from .cache import conversion_key
+from .store import get_store
+
+
+def init_env(app):
+    """Make sure the tracking data exists on the environment"""
+    env = app.env
+    for attr in ('tlisp_used', 'tlisp_globs', 'tlisp_xrefs'):
+        if not hasattr(env, attr):
+            setattr(env, attr, {})
+
+
+def versioned(name, version):
+    """Return the tracking name of *name* in API *version*"""
+    name = name.lower()
+    return '%s/%s' % (version, name) if version else name
+
+
+def note_function(env, name):
+    """Record that the current document renders function *name*"""
+    env.tlisp_used.setdefault(env.docname, set()).add(
+        versioned(name, env.temp_data.get('tl:version')))
+
+
+def note_pattern(env, pattern):
+    """Record that the current document expands the wildcard *pattern*"""
+    env.tlisp_globs.setdefault(env.docname, set()).add(
+        versioned(pattern, env.temp_data.get('tl:version')))
+
+
+def collect_xrefs(app, doctree):
+    """Record the TLisp functions cross-referenced by a document"""
+    env = app.env
+    names = set()
+    for node in doctree.traverse(addnodes.pending_xref):
+        if node.get('refdomain') == 'tl':
+            names.add(versioned(node['reftarget'].strip('()'),
+                                node.get('tl:version')))
+    if names:
+        env.tlisp_xrefs[env.docname] = names
+
+
+def purge_doc(app, env, docname):
+    for attr in ('tlisp_used', 'tlisp_globs', 'tlisp_xrefs'):
+        getattr(env, attr).pop(docname, None)
+
+
+def merge_info(app, env, docnames, other):
+    for attr in ('tlisp_used', 'tlisp_globs', 'tlisp_xrefs'):
+        data = getattr(env, attr)
+        otherdata = getattr(other, attr)
+        for docname in docnames:
+            if docname in otherdata:
+                data[docname] = otherdata[docname]
+
+
+def get_outdated(app, env, added, changed, removed):
+    """
+    Compare the function fingerprints against those stored at the last read
+    and return the documents using any function that changed.
+    """
+    store = get_store(app)
+    if store is None or store.key is None:
+        return []
+    if hasattr(env, 'tlisp_fingerprints'):
+        # Kept in the environment by earlier versions
+        del env.tlisp_fingerprints
+    previous_key = getattr(env, 'tlisp_key', None)
+    env.tlisp_key = store.key
+    if previous_key == store.key:
+        # No function list changed, so there is no need to load them
+        return []
+    current = store.fingerprints()
+    saved = store.load_fingerprints(previous_key) if previous_key else None
+    store.save_fingerprints(current)
+    if saved is None:
+        # No record of what was read before, so everything is suspect
+        return [docname for docname in env.all_docs if docname not in removed]
+    converted, previous = saved
+    if converted != conversion_key(app.config):
+        # A new extension version or napoleon settings: every function may
+        # render differently, even with the same fingerprint
+        outdated = (set(env.tlisp_used) | set(env.tlisp_globs)) - set(removed)
+        print("[tlisp] Conversion settings changed; %d documents outdated"
+              % len(outdated))
+        return sorted(outdated)
+
+    modified = set(name for name, fp in current.items()
+                   if previous.get(name, fp) != fp)
+    appeared = set(current) - set(previous)
+    vanished = set(previous) - set(current)
+    if not (modified or appeared or vanished):
+        return []
+
+    # A function added to or removed from any version changes the version
+    # links of its descriptions in the others
+    moved = set(name.split('/')[-1] for name in appeared | vanished)
+    outdated = set()
+    for docname, names in env.tlisp_used.items():
+        if names & (modified | appeared | vanished):
+            outdated.add(docname)
+        elif moved and moved & set(name.split('/')[-1] for name in names):
+            outdated.add(docname)
+    for docname, names in env.tlisp_xrefs.items():
+        if names & (appeared | vanished):
+            outdated.add(docname)
+    for docname, patterns in env.tlisp_globs.items():
+        if any(fnmatchcase(name, pattern)
+               for pattern in patterns for name in appeared | vanished):
+            outdated.add(docname)
+    outdated -= set(removed)
+    print("[tlisp] %d functions changed, %d added, %d removed; "
+          "%d documents outdated" % (len(modified), len(appeared),
+                                     len(vanished), len(outdated)))
+    return sorted(outdated)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.index
+    ~~~~~~~~~~~~~~~~~
+
+    Name index for expanding tlispsummary wildcards.
+
+    Names are kept sorted forwards and reversed, so a pattern with a literal
+    prefix or suffix maps onto a bisected range, and a trigram index narrows
+    patterns such as ``*Type*`` whose literal parts are in the middle. Only
+    the candidates are matched against the full pattern.
+"""
+import re
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+
+_wildcard_regex = re.compile(r'\*|\?|\[[^\]]*\]')
+
+
+def is_pattern(name):
+    """Return True if *name* contains glob wildcards"""
+    return _wildcard_regex.search(name) is not None
+
+
+def _trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TLispNameIndex(object):
+    """
+    Glob lookups on a list of lower case function names. Results are
+    returned in the order the names were given.
+    """
+    def __init__(self, names):
+        self._order = dict((name, i) for i, name in enumerate(names))
+        self._forward = sorted(self._order)
+        self._reverse = sorted(name[::-1] for name in self._order)
+        self._trigrams = {}
+        for name in self._order:
+            for gram in _trigrams(name):
+                self._trigrams.setdefault(gram, set()).add(name)
+
+    def __len__(self):
+        return len(self._order)
+
+    @staticmethod
+    def _range(keys, prefix):
+        lo = bisect_left(keys, prefix)
+        hi = bisect_left(keys, prefix + u'\uffff', lo)
+        return lo, hi
+
+    def match(self, pattern):
+        """Return the names matching the glob *pattern*, case insensitively"""
+        pattern = pattern.lower()
+        literals = _wildcard_regex.split(pattern)
+        if len(literals) == 1:
+            return [pattern] if pattern in self._order else []
+
+        # Pick whichever of prefix, suffix or trigram lookup gives the
+        # fewest candidates
+        lo, hi = self._range(self._forward, literals[0])
+        candidates = lambda: self._forward[lo:hi]
+        size = hi - lo
+        if literals[-1]:
+            rlo, rhi = self._range(self._reverse, literals[-1][::-1])
+            if rhi - rlo < size:
+                size = rhi - rlo
+                candidates = lambda: [name[::-1]
+                                      for name in self._reverse[rlo:rhi]]
+        grams = set()
+        for literal in literals[1:-1]:
+            grams |= _trigrams(literal)
+        if grams:
+            sets = sorted((self._trigrams.get(gram, set()) for gram in grams),
+                          key=len)
+            if len(sets[0]) < size:
+                candidates = lambda: set.intersection(*sets)
+
+        result = [name for name in candidates() if fnmatchcase(name, pattern)]
+        result.sort(key=self._order.get)
+        return result
@@ -17,3 +17,7 @@ class tlisp_parameterlist(addnodes.desc_parameterlist):
 class tlisp_parameter(addnodes.desc_parameter):
     """Node for a single lisp parameter."""
     pass
+
+class tlisp_optional(addnodes.desc_optional):
+    """Node for an optional lisp parameter, written [arg]."""
+    pass
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.profile
+    ~~~~~~~~~~~~~~~~~~~
+
+    Opt-in timing of the extension's build phases.
+
+    With ``tlisp_profile = True`` (or a file name) the time spent in each
+    phase, a few counters and the slowest docstring conversions are written
+    as JSON to ``tlisp-profile.json`` in the output directory when the build
+    finishes. Phases may nest, e.g. autotlisp includes the conversion of the
+    function it documents. Conversions done by a ``tlisp_workers`` pool are
+    timed in the workers and reported with the others; work done in ``-j``
+    reader processes is not included.
+
+    The profile is kept in a Profiler on the application, and the catalogs
+    it loads, so each application and build has its own. When profiling is
+    off its ``stats`` is None and every hook is a single test.
+"""
+import os.path
+import json
+import heapq
+import time
+
+# Number of slowest conversions to report
+SLOWEST = 20
+
+DEFAULT_FILE = 'tlisp-profile.json'
+# tlisp_profile values given as strings, e.g. with -D, that are not file names
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+class BuildStats(object):
+    """Timings and counters collected during one build"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}        # type: Dict[unicode, List[float, int]]
+        self.counters = {}      # type: Dict[unicode, int]
+        self.conversions = []   # type: List[Tuple[float, unicode]]
+
+    def add_time(self, name, seconds):
+        entry = self.phases.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def note_conversion(self, name, seconds):
+        self.add_time('conversion', seconds)
+        self.count('functions converted')
+        if len(self.conversions) < SLOWEST:
+            heapq.heappush(self.conversions, (seconds, name))
+        else:
+            heapq.heappushpop(self.conversions, (seconds, name))
+
+    def report(self):
+        return {
+            'total': round(time.time() - self.start, 6),
+            'phases': dict((name, {'seconds': round(seconds, 6),
+                                   'calls': calls})
+                           for name, (seconds, calls) in self.phases.items()),
+            'counters': self.counters,
+            'slowest conversions': [
+                {'function': name, 'seconds': round(seconds, 6)}
+                for seconds, name in sorted(self.conversions, reverse=True)],
+        }
+
+
+class Profiler(object):
+    """
+    The profile of an application's builds: *stats* holds the timings of the
+    current build, or is None when profiling is off.
+    """
+
+    def __init__(self):
+        self.stats = None   # type: BuildStats
+
+    def start(self, enabled):
+        self.stats = BuildStats() if enabled else None
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        if self.stats is not None:
+            self.stats.count(name, n)
+
+
+# The profiler of code running without an application, e.g. apidoc
+NULL = Profiler()
+
+
+class _Phase(object):
+    """Context manager adding the time spent in a block to a phase"""
+    __slots__ = ('profiler', 'name', 'started')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.stats is not None:
+            self.started = time.time()
+
+    def __exit__(self, *exc):
+        stats = self.profiler.stats
+        if stats is not None:
+            stats.add_time(self.name, time.time() - self.started)
+
+
+def get_profiler(app_or_env):
+    """Return the Profiler of a Sphinx application or environment"""
+    app = getattr(app_or_env, 'app', app_or_env)
+    return getattr(app, 'tlisp_profiler', None) or NULL
+
+
+def phase(app_or_env, name):
+    return get_profiler(app_or_env).phase(name)
+
+
+def count(app_or_env, name, n=1):
+    get_profiler(app_or_env).count(name, n)
+
+
+def start_profile(app):
+    if getattr(app, 'tlisp_profiler', None) is None:
+        app.tlisp_profiler = Profiler()
+    enabled = app.config.tlisp_profile
+    if isinstance(enabled, str) and enabled.lower() in FALSE_VALUES:
+        enabled = False
+    app.tlisp_profiler.start(enabled)
+
+
+def write_profile(app, exception):
+    profiler = get_profiler(app)
+    stats = profiler.stats
+    if stats is None:
+        return
+    fn = app.config.tlisp_profile
+    if not isinstance(fn, str) or fn.lower() in TRUE_VALUES:
+        fn = DEFAULT_FILE
+    with open(os.path.join(app.outdir, fn), 'w') as fh:
+        json.dump(stats.report(), fh, indent=2, sort_keys=True)
+    print("[tlisp] Wrote build profile to", os.path.join(app.outdir, fn))
+    profiler.stats = None
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.quickref
+    ~~~~~~~~~~~~~~~~~~~~
+
+    A quick reference of the TLisp functions, written without Sphinx::
+
+        python -m sphinxtlisp.quickref [function_list.txt] [-o build/quickref]
+                                       [-f html text] [--shard] [--brief]
+                                       [-c source]
+
+    The reference is rendered straight from the catalog: the parsed
+    signature of each function and its converted record, i.e. the parameter
+    descriptions, tables, examples and notes, or with ``--brief`` just the
+    summary and parameter types.
+    Docutils is not run and no doctrees are written, so it takes a fraction
+    of the time of a full build: the few constructs the docstring conversion
+    generates are rendered directly. The output is one ``quickref.html`` and
+    ``quickref.txt``, or with ``--shard`` one file per first character of the
+    function names (as in the search index) plus an index page.
+
+    The docstrings are converted with the napoleon settings of the Sphinx
+    build's conf.py (``-c``, ``source`` by default), and the converted
+    records can be kept between runs with ``--cache``, e.g. in the catalog
+    cache of a Sphinx build using the same function list. Run it from the
+    top of the repository, next to ``apidoc.py``.
+"""
+import os
+import os.path
+import re
+import sys
+import json
+import time
+import argparse
+import textwrap
+from html import escape
+from types import SimpleNamespace
+
+from .cache import catalog_key, load_catalog, save_catalog
+from .signature import OPTIONAL, VARIADIC
+from .search import shard_key
+from .tlisp import read_functions, napoleon_config
+from apidoc import write_file
+
+FORMATS = ('html', 'text')
+TITLE = 'TLisp Function Reference'
+
+# The markup of the converted docstrings
+_markup_regex = re.compile(r'``(.+?)``|\*\*(.+?)\*\*|:tl:function:`([^`]+)`')
+_directive_regex = re.compile(r'\.\. ([\w:]+)::\s*(.*)$')
+_field_regex = re.compile(r':(\w[\w ]*):(?:\s+(.*))?$')
+_term_regex = re.compile(r'\*\*(.+?)\*\*(?: : (.*))?$')
+
+HTML_HEADER = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+body { font-family: sans-serif; max-width: 60em; margin: auto; padding: 1em; }
+nav a { margin-right: .4em; }
+dt { margin-top: 1.2em; font-family: monospace; font-size: 110%%; }
+dt .name { font-weight: bold; }
+dt .optional, dt .variadic { color: #555; }
+dd p { margin: .3em 0; }
+dd .params { color: #333; }
+dd dt { margin-top: .3em; font-size: 100%%; }
+dd table { border-collapse: collapse; margin: .3em 0; }
+dd td { border: 1px solid #ddd; padding: .1em .4em; vertical-align: top; }
+dd .rubric { font-weight: bold; }
+dd pre { background: #f6f6f6; padding: .5em; }
+</style>
+</head>
+<body>
+<h1>%(title)s</h1>
+'''
+
+HTML_FOOTER = '''</body>
+</html>
+'''
+
+
+def shard_title(key):
+    """The heading of the shard *key*"""
+    return 'Symbols' if key == '_' else key.upper()
+
+
+def parse_blocks(doc):
+    """
+    Split a converted docstring into a tree of [kind, data, children]
+    blocks, nested by indentation. The kinds are those the conversion
+    generates: 'para', 'field' (name, text), 'term' (parameter name, type),
+    'table' (rows), 'rubric' and 'admonition' (name, text), and 'literal'
+    (lines) for doctest and literal blocks.
+    """
+    lines = doc.splitlines()
+    root = []
+    stack = [(-1, root)]    # (indent, children) of the open blocks
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        text = line.strip()
+        i += 1
+        if not text:
+            continue
+        indent = len(line) - len(line.lstrip())
+        # Lines indented under this one, up to the next one that is not
+        body = []
+        while i < len(lines) and (not lines[i].strip() or
+                                  len(lines[i]) - len(lines[i].lstrip()) >
+                                  indent):
+            body.append(lines[i].strip())
+            i += 1
+        directive = _directive_regex.match(text)
+        if directive and directive.group(1) == 'tl:table':
+            blocks = [['table', [json.loads(row) for row in body
+                                 if row and not row.startswith(':')], []]]
+        elif directive:
+            words = ' '.join([directive.group(2)] + body).split()
+            kind = 'rubric' if directive.group(1) == 'rubric' else 'admonition'
+            blocks = [[kind, (directive.group(1), ' '.join(words)), []]]
+        else:
+            # Give back the indented lines, they are blocks of their own
+            i -= len(body)
+            field = _field_regex.match(text)
+            term = _term_regex.match(text)
+            if field:
+                blocks = [['field', field.groups(''), []]]
+            elif term:
+                blocks = [['term', term.groups(''), []]]
+            else:
+                blocks, i = _text_blocks(lines, i - 1, indent)
+        for block in blocks:
+            while stack[-1][0] >= indent:
+                stack.pop()
+            stack[-1][1].append(block)
+            stack.append((indent, block[2]))
+    return root
+
+
+def _text_blocks(lines, i, indent):
+    """
+    Return the blocks of the text starting at line *i*, and the line after
+    them: a paragraph, running to the next blank line or directive, and
+    any doctest lines (>>>) in it or literal block after it ('::') as
+    'literal' blocks of lines kept as written.
+    """
+    blocks = []
+    para = []
+    while i < len(lines) and lines[i].strip() and \
+            not lines[i].lstrip().startswith('.. '):
+        if lines[i].lstrip().startswith('>>>'):
+            break
+        para.append(lines[i].strip())
+        i += 1
+    if para:
+        blocks.append(['para', ' '.join(para), []])
+    if i < len(lines) and lines[i].lstrip().startswith('>>>'):
+        # A doctest block runs to the next blank line
+        start = i
+        while i < len(lines) and lines[i].strip():
+            i += 1
+        blocks.append(['literal', _dedent(lines[start:i]), []])
+    elif para and para[-1].endswith('::'):
+        # 'text::' reads 'text:', 'text ::' and a lone '::' are dropped
+        text = blocks[-1][1][:-2]
+        if not text:
+            blocks.pop()
+        elif text.endswith(' '):
+            blocks[-1][1] = text.rstrip()
+        else:
+            blocks[-1][1] = text + ':'
+        start = i
+        while i < len(lines) and (not lines[i].strip() or
+                                  len(lines[i]) - len(lines[i].lstrip()) >
+                                  indent):
+            i += 1
+        literal = _dedent(lines[start:i])
+        if literal:
+            blocks.append(['literal', literal, []])
+    return blocks, i
+
+
+def _dedent(lines):
+    """The lines of a literal block, without their common indentation"""
+    return textwrap.dedent('\n'.join(lines)).strip('\n').splitlines()
+
+
+class QuickReference(object):
+    """
+    Render the functions of a catalog as HTML and plain text, grouped by the
+    first character of their names. Each function has its signature and its
+    converted docstring, or with *brief* its summary and parameter types.
+    """
+
+    def __init__(self, catalog, brief=False):
+        self.catalog = catalog
+        self.brief = brief
+        self.shards = {}    # type: Dict[unicode, List[unicode]]
+        for name in sorted(catalog):
+            self.shards.setdefault(shard_key(name), []).append(name)
+        self.keys = sorted(self.shards)
+        self._page = {}     # function name -> page holding it, for links
+
+    # HTML
+
+    def html_signature(self, signature):
+        parts = ['<span class="name">%s</span>' % escape(signature.name)]
+        for arg in signature.arguments:
+            if arg.kind in (OPTIONAL, VARIADIC):
+                parts.append('<span class="%s">%s</span>'
+                             % (arg.kind, escape(arg.text)))
+            else:
+                parts.append(escape(arg.text))
+        text = '(%s)' % ' '.join(parts)
+        if signature.retann:
+            text += ' &rarr; <span class="retann">%s</span>' % escape(
+                signature.retann)
+        return text
+
+    def html_link(self, word, page):
+        key = word.lower()
+        if key not in self.catalog.allnames:
+            return word
+        target = self._page.get(key, page)
+        href = '#' + key if target == page else '%s#%s' % (target, key)
+        return '<a href="%s">%s</a>' % (escape(href), word)
+
+    def html_inline(self, text, page):
+        out = []
+        pos = 0
+        for m in _markup_regex.finditer(text):
+            out.append(escape(text[pos:m.start()]))
+            literal, strong, link = m.groups()
+            if literal is not None:
+                out.append('<code>%s</code>' % escape(literal))
+            elif strong is not None:
+                out.append('<strong>%s</strong>' % escape(strong))
+            else:
+                out.append(self.html_link(escape(link), page))
+            pos = m.end()
+        out.append(escape(text[pos:]))
+        return ''.join(out)
+
+    def html_blocks(self, blocks, page):
+        out = []
+        for kind, data, children in blocks:
+            inner = self.html_blocks(children, page)
+            if kind == 'literal':
+                out.append('<pre>%s</pre>' % '\n'.join(
+                    self.html_inline(line, page) for line in data))
+            elif kind == 'table':
+                out.append('<table>\n%s</table>' % ''.join(
+                    '<tr>%s</tr>\n' % ''.join(
+                        '<td>%s</td>' % self.html_inline(cell, page)
+                        for cell in row)
+                    for row in data))
+            elif kind == 'rubric':
+                out.append('<p class="rubric">%s</p>'
+                           % self.html_inline(data[1], page))
+            elif kind == 'admonition':
+                out.append('<p class="%s"><strong>%s:</strong> %s</p>' % (
+                    data[0], data[0].capitalize(),
+                    self.html_inline(data[1], page)))
+            elif kind == 'field':
+                out.append('<p><strong>%s:</strong>%s</p>' % (
+                    escape(data[0].capitalize()),
+                    ' ' + self.html_inline(data[1], page) if data[1] else ''))
+                if inner:
+                    out.append('<dl>\n%s\n</dl>' % inner)
+                continue
+            elif kind == 'term':
+                out.append('<dt><code>%s</code>%s</dt>' % (
+                    escape(data[0]), ' (%s)' % escape(data[1])
+                    if data[1] else ''))
+                out.append('<dd>%s</dd>' % inner)
+                continue
+            else:
+                out.append('<p>%s</p>' % self.html_inline(data, page))
+            if inner:
+                out.append('<blockquote>%s</blockquote>' % inner)
+        return '\n'.join(out)
+
+    def html_function(self, name, page):
+        body = []
+        obj = self.catalog[name]
+        if not self.brief:
+            description = self.html_blocks(parse_blocks(obj.doc), page)
+            if description:
+                body.append(description)
+        else:
+            if obj.summary_text:
+                body.append('<p>%s</p>' % escape(obj.summary_text))
+            if obj.params:
+                body.append('<p class="params">Parameters: %s</p>' % ', '.join(
+                    '<code>%s</code>%s' % (escape(param), ' (%s)' % escape(typ)
+                                           if typ else '')
+                    for param, typ in obj.params))
+        out = '<dt id="%s">%s</dt>\n' % (
+            escape(name), self.html_signature(self.catalog.signature(name)))
+        if body:
+            out += '<dd>%s</dd>\n' % '\n'.join(body)
+        return out
+
+    def html_nav(self, href):
+        return '<nav>%s</nav>\n' % ' '.join(
+            '<a href="%s">%s</a>' % (escape(href(key)), shard_title(key))
+            for key in self.keys)
+
+    def html_shard(self, key, page):
+        out = ['<h2 id="shard-%s">%s</h2>\n<dl>\n' % (key, shard_title(key))]
+        out.extend(self.html_function(name, page) for name in self.shards[key])
+        out.append('</dl>\n')
+        return ''.join(out)
+
+    def html_single(self, page):
+        """Return the whole reference as one HTML page"""
+        self._page = {}
+        out = [HTML_HEADER % {'title': TITLE},
+               self.html_nav(lambda key: '#shard-' + key)]
+        out.extend(self.html_shard(key, page) for key in self.keys)
+        out.append(HTML_FOOTER)
+        return ''.join(out)
+
+    def html_sharded(self):
+        """Return {file name: HTML page}: an index and one page per shard"""
+        self._page = dict((name, key + '.html')
+                          for key, names in self.shards.items()
+                          for name in names)
+        nav = self.html_nav(lambda key: key + '.html')
+        pages = {}
+        index = [HTML_HEADER % {'title': TITLE}, nav]
+        for key in self.keys:
+            page = key + '.html'
+            pages[page] = ''.join([
+                HTML_HEADER % {'title': '%s: %s' % (TITLE, shard_title(key))},
+                '<p><a href="index.html">Index</a></p>\n', nav,
+                self.html_shard(key, page), HTML_FOOTER])
+            index.append('<h2>%s</h2>\n<p>%s</p>\n' % (
+                shard_title(key), ' '.join(
+                    '<a href="%s#%s">%s</a>' % (
+                        page, escape(name),
+                        escape(self.catalog.signature(name).name))
+                    for name in self.shards[key])))
+        index.append(HTML_FOOTER)
+        pages['index.html'] = ''.join(index)
+        return pages
+
+    # Plain text
+
+    @staticmethod
+    def text_inline(text):
+        return _markup_regex.sub(lambda m: m.group(m.lastindex), text)
+
+    def text_blocks(self, blocks, indent='    '):
+        out = []
+        for kind, data, children in blocks:
+            if kind == 'literal':
+                out.extend((indent + self.text_inline(line)).rstrip()
+                           for line in data)
+            elif kind == 'table':
+                rows = [[self.text_inline(cell) for cell in row]
+                        for row in data]
+                widths = [max(len(row[col]) for row in rows if col < len(row))
+                          for col in range(max(len(row) for row in rows))]
+                out.extend((indent + '  '.join(
+                    cell.ljust(width) for cell, width in zip(row, widths)
+                    )).rstrip() for row in rows)
+            elif kind == 'term':
+                out.append(indent + ('%s (%s)' % data if data[1]
+                                     else data[0]))
+            else:
+                if kind == 'field':
+                    text = '%s: %s' % (data[0].capitalize(), data[1])
+                elif kind == 'rubric':
+                    text = data[1] + ':'
+                elif kind == 'admonition':
+                    text = '%s: %s' % (data[0].capitalize(), data[1])
+                else:
+                    text = data
+                out.append(textwrap.fill(
+                    self.text_inline(text).rstrip(), 79, initial_indent=indent,
+                    subsequent_indent=indent, break_long_words=False,
+                    break_on_hyphens=False))
+            out.extend(self.text_blocks(children, indent + '    '))
+        return out
+
+    def text_function(self, name):
+        out = [self.catalog.signature(name).text]
+        obj = self.catalog[name]
+        if not self.brief:
+            out.extend(self.text_blocks(parse_blocks(obj.doc)))
+        else:
+            if obj.summary_text:
+                out.append(textwrap.fill(obj.summary_text, 79,
+                                         initial_indent='    ',
+                                         subsequent_indent='    '))
+            if obj.params:
+                out.append(textwrap.fill(
+                    'Parameters: ' + ', '.join(
+                        '%s (%s)' % (param, typ) if typ else param
+                        for param, typ in obj.params), 79,
+                    initial_indent='    ', subsequent_indent='        '))
+        return '\n'.join(out) + '\n'
+
+    def text_shard(self, key):
+        heading = shard_title(key)
+        out = [heading + '\n' + '-' * len(heading) + '\n']
+        out.extend(self.text_function(name) for name in self.shards[key])
+        return '\n'.join(out)
+
+    def text_single(self):
+        """Return the whole reference as one text file"""
+        heading = TITLE + '\n' + '=' * len(TITLE) + '\n'
+        return '\n'.join([heading] + [self.text_shard(key)
+                                      for key in self.keys])
+
+    def text_sharded(self):
+        """Return {file name: text}, one file per shard"""
+        return dict((key + '.txt', self.text_shard(key)) for key in self.keys)
+
+    def render(self, fmt, shard=False):
+        """Return {file name: content} for the format *fmt*"""
+        if fmt == 'html':
+            if shard:
+                return self.html_sharded()
+            return {'quickref.html': self.html_single('quickref.html')}
+        if shard:
+            return self.text_sharded()
+        return {'quickref.txt': self.text_single()}
+
+
+def read_catalog(fn, workers=1, cache=None, confdir='source'):
+    """
+    Read the function list *fn* and convert all its docstrings with the
+    napoleon settings of the conf.py in *confdir*, using and updating the
+    catalog cache *cache* if given.
+    """
+    config = napoleon_config(confdir)
+    key = catalog_key(fn, config)
+    catalog = load_catalog(cache, key) if cache else None
+    if catalog is not None:
+        print("[tlisp] Loaded function list from cache", cache)
+        catalog.bind(config)
+    else:
+        catalog = read_functions(fn, SimpleNamespace(config=config))
+    catalog.convert_all(workers)
+    if cache and catalog.modified:
+        save_catalog(cache, key, catalog)
+    return catalog
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sphinxtlisp.quickref',
+        description='Write a quick reference of the TLisp functions')
+    parser.add_argument('function_list', nargs='?', default='function_list.txt',
+                        help='function list, or function database, to read')
+    parser.add_argument('-c', '--conf-dir', default='source',
+                        help='directory of the conf.py with the napoleon '
+                             'settings of the Sphinx build')
+    parser.add_argument('-o', '--output-dir', default='build/quickref')
+    parser.add_argument('-f', '--format', nargs='+', choices=FORMATS,
+                        default=list(FORMATS))
+    parser.add_argument('--shard', action='store_true',
+                        help='one file per first character of the function '
+                             'names, plus an HTML index')
+    parser.add_argument('--brief', action='store_true',
+                        help='summaries and parameter types instead of the '
+                             'whole docstrings')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='processes converting the docstrings')
+    parser.add_argument('--cache',
+                        help='catalog cache to read and update, e.g. '
+                             'build/doctrees/tlisp-catalog.pickle')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    catalog = read_catalog(args.function_list, args.workers, args.cache,
+                           args.conf_dir)
+    reference = QuickReference(catalog, args.brief)
+    written = unchanged = 0
+    for fmt in args.format:
+        outdir = args.output_dir
+        if args.shard:
+            outdir = os.path.join(outdir, fmt)
+        os.makedirs(outdir, exist_ok=True)
+        for filename, text in sorted(reference.render(fmt, args.shard).items()):
+            name, ext = os.path.splitext(filename)
+            if write_file(outdir, name, text, ext[1:]):
+                written += 1
+            else:
+                unchanged += 1
+    print("[tlisp] Quick reference of %d functions in %s: %d files written, "
+          "%d unchanged (%.2fs)" % (len(catalog), args.output_dir, written,
+                                    unchanged, time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
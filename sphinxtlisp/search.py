@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.search
+    ~~~~~~~~~~~~~~~~~~
+
+    Compact TLisp function index for the HTML search page.
+
+    Rather than relying on the full-text ``searchindex.js``, the functions are
+    written to small script shards under ``_static/tlispindex``, one per
+    first character. Each shard is a name sorted list of
+    ``[name, signature, summary, target]`` entries, so ``tlispsearch.js`` only
+    loads the shard for the query and finds prefix matches by bisection.
+    The shards are only rewritten when the documented functions or the
+    function lists changed.
+"""
+import os
+import os.path
+import json
+import hashlib
+import shutil
+import string
+
+from .store import get_store, get_catalog
+from . import profile, __version__
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+INDEX_DIR = 'tlispindex'
+KEY_FILE = 'key.txt'
+
+
+def shard_key(name):
+    """Return the shard holding *name*: its first character, or '_'"""
+    c = name[:1].lower()
+    return c if c and c in string.ascii_lowercase + string.digits else '_'
+
+
+def build_index(app, env):
+    """Return {shard key: sorted entries} for all documented TLisp symbols"""
+    functions = get_catalog(app) or {}
+    domain = env.get_domain('tl')
+    shards = {}
+    for name, dispname, objtype, docname, anchor, prio in domain.get_objects():
+        if '/' in name:
+            # Only the current API version is searched
+            continue
+        signature = summary = ''
+        if name.lower() in functions:
+            obj = functions[name.lower()]
+            signature = obj.tlisp_signature
+            summary = obj.summary_text
+        target = app.builder.get_target_uri(docname) + '#' + anchor
+        shards.setdefault(shard_key(name), []).append(
+            [name, signature, summary, target])
+    for entries in shards.values():
+        entries.sort(key=lambda entry: entry[0].lower())
+    return shards
+
+
+def index_key(app, env):
+    """Return a digest of everything the index shards are built from"""
+    store = get_store(app)
+    h = hashlib.sha1(('%s %s %s' % (__version__, app.builder.name,
+                                    store.key)).encode('utf-8'))
+    for entry in sorted(env.get_domain('tl').get_objects()):
+        h.update(repr(entry).encode('utf-8'))
+    return h.hexdigest()
+
+
+def add_static_path(app):
+    """Have HTML builds copy tlispsearch.js with the other static files"""
+    if app.builder.format != 'html' or not app.config.tlisp_search_index:
+        return
+    if STATIC_DIR not in app.config.html_static_path:
+        app.config.html_static_path = (list(app.config.html_static_path) +
+                                       [STATIC_DIR])
+
+
+def add_search_script(app, pagename, templatename, context, doctree):
+    """Load tlispsearch.js on the search page, the only one using it"""
+    if pagename != 'search' or not app.config.tlisp_search_index:
+        return
+    # A copy, as older Sphinx versions pass the builder's own list
+    context['script_files'] = (list(context.get('script_files', [])) +
+                               ['_static/tlispsearch.js'])
+
+
+def write_search_index(app, env):
+    """Write the TLisp index shards for HTML builds"""
+    if app.builder.format != 'html' or not app.config.tlisp_search_index:
+        return
+    with profile.phase(app, 'search index'):
+        _write_shards(app, env)
+
+
+def _write_shards(app, env):
+    staticdir = os.path.join(app.outdir, '_static')
+    indexdir = os.path.join(staticdir, INDEX_DIR)
+    key = index_key(app, env)
+    try:
+        with open(os.path.join(indexdir, KEY_FILE)) as fh:
+            if fh.read() == key:
+                return
+    except (IOError, OSError):
+        pass
+    if os.path.isdir(indexdir):
+        shutil.rmtree(indexdir)
+    os.makedirs(indexdir)
+    for shard, entries in build_index(app, env).items():
+        with open(os.path.join(indexdir, shard + '.js'), 'w') as fh:
+            fh.write('TLispSearch.addShard(%s,%s);' % (
+                json.dumps(shard), json.dumps(entries, separators=(',', ':'))))
+    with open(os.path.join(indexdir, KEY_FILE), 'w') as fh:
+        fh.write(key)
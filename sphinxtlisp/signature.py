@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.signature
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Parsed TLisp signatures.
+
+    A signature such as ``(objGetData obj attrib [default]) -> data`` is
+    parsed once into a TLispSignature with its arguments classified as
+    required, optional (``[arg]``) or variadic (``...``, ``[arg]*``,
+    ``[arg...]``). The catalog keeps the parsed signature of every function
+    for the domain, autodoc and summary code.
+"""
+import re
+
+# REs for TLisp signatures
+tlisp_sig_re = re.compile(
+    r'''^\(([\w+-/*@!<=>]+)\s*             # symbol name
+          (?: (.*))? \)         # optional: arguments
+          (?:\s* -> \s* (.*))?  # optional: return annotation
+          $                     # and nothing more
+          ''', re.VERBOSE)
+
+# The arguments group above is greedy, so a return annotation holding a
+# closing paren, e.g. "-> text (or Nil)", ends up in it
+_retann_regex = re.compile(r'\)\s*->\s*')
+_argument_regex = re.compile(r'\[[^\]]*\]\*?|\S+')
+
+REQUIRED = 'required'
+OPTIONAL = 'optional'
+VARIADIC = 'variadic'
+
+
+class TLispArgument(object):
+    """
+    One argument of a signature: its *name* (empty for a bare ``...``), its
+    *kind* and the *text* as written. A bracketed group such as
+    ``[cond1 exp1]`` is a single argument.
+    """
+    __slots__ = ('name', 'kind', 'text')
+
+    def __init__(self, name, kind, text):
+        self.name = name
+        self.kind = kind
+        self.text = text
+
+    @classmethod
+    def parse(cls, text):
+        if text.startswith('[') and text.rstrip('*').endswith(']'):
+            name = text[1:text.rindex(']')]
+            if text.endswith('*') or name.endswith('..'):
+                return cls(name.rstrip('.'), VARIADIC, text)
+            return cls(name, OPTIONAL, text)
+        if text.endswith('..'):
+            return cls(text.rstrip('.'), VARIADIC, text)
+        return cls(text, REQUIRED, text)
+
+    def __getstate__(self):
+        return (self.name, self.kind, self.text)
+
+    def __setstate__(self, state):
+        self.name, self.kind, self.text = state
+
+    def __repr__(self):
+        return '<TLispArgument %s %s>' % (self.kind, self.text)
+
+
+class TLispSignature(object):
+    """
+    The parsed signature of a TLisp function. *text* is the signature as
+    written, *arguments* a tuple of TLispArgument and *retann* the return
+    annotation or None.
+    """
+    __slots__ = ('name', 'arguments', 'retann', 'text')
+
+    def __init__(self, name, arguments=(), retann=None, text=None):
+        self.name = name
+        self.arguments = arguments
+        self.retann = retann
+        self.text = text
+
+    @classmethod
+    def parse(cls, sig):
+        """Parse the signature *sig*, or return None if it is not one"""
+        m = tlisp_sig_re.match(sig)
+        if m is None:
+            return None
+        name, arglist, retann = m.groups()
+        arglist = arglist or ''
+        if retann is None:
+            split = _retann_regex.search(arglist)
+            if split:
+                arglist, retann = (arglist[:split.start()],
+                                   arglist[split.end():] + ')')
+        arguments = tuple(TLispArgument.parse(text) for text in
+                          _argument_regex.findall(arglist))
+        return cls(name, arguments, retann, sig.strip())
+
+    @property
+    def arglist(self):
+        """The arguments as written, separated by single spaces"""
+        return ' '.join(arg.text for arg in self.arguments)
+
+    @property
+    def args(self):
+        """The argument names, the words of a bracketed group separately"""
+        return [word for arg in self.arguments for word in arg.name.split()
+                if word.strip('.')]
+
+    def __getstate__(self):
+        return (self.name, self.arguments, self.retann, self.text)
+
+    def __setstate__(self, state):
+        self.name, self.arguments, self.retann, self.text = state
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return '<TLispSignature %s>' % self.text
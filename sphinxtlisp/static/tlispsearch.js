@@ -0,0 +1,82 @@
+/*
+ * tlispsearch.js
+ * ~~~~~~~~~~~~~~
+ *
+ * Instant TLisp function lookup for the search page. Only the index shard
+ * for the first character of the query is loaded, and matches are found by
+ * bisecting its name sorted entries.
+ */
+
+var TLispSearch = {
+  shards : {},
+  query : null,
+  maxResults : 50,
+
+  shardKey : function(name) {
+    var c = name.charAt(0).toLowerCase();
+    return /[a-z0-9]/.test(c) ? c : '_';
+  },
+
+  addShard : function(key, entries) {
+    this.shards[key] = entries;
+    if (this.query && this.shardKey(this.query) === key)
+      this.show(this.query);
+  },
+
+  search : function(query) {
+    var key = this.shardKey(query);
+    this.query = query;
+    if (this.shards[key]) {
+      this.show(query);
+      return;
+    }
+    var script = document.createElement('script');
+    script.src = DOCUMENTATION_OPTIONS.URL_ROOT + '_static/tlispindex/' +
+      encodeURIComponent(key) + '.js';
+    document.getElementsByTagName('head')[0].appendChild(script);
+  },
+
+  lookup : function(entries, prefix) {
+    var lo = 0, hi = entries.length;
+    while (lo < hi) {
+      var mid = (lo + hi) >> 1;
+      if (entries[mid][0].toLowerCase() < prefix)
+        lo = mid + 1;
+      else
+        hi = mid;
+    }
+    var results = [];
+    for (var i = lo; i < entries.length && results.length < this.maxResults; i++) {
+      if (entries[i][0].toLowerCase().indexOf(prefix) !== 0)
+        break;
+      results.push(entries[i]);
+    }
+    return results;
+  },
+
+  show : function(query) {
+    var results = this.lookup(this.shards[this.shardKey(query)],
+                              query.toLowerCase());
+    if (!results.length)
+      return;
+    var list = $('<ul class="search tlisp-search"/>');
+    $.each(results, function(i, entry) {
+      var item = $('<li/>');
+      item.append($('<a/>').attr('href', DOCUMENTATION_OPTIONS.URL_ROOT + entry[3])
+                  .append($('<code/>').text(entry[1] || entry[0])));
+      if (entry[2])
+        item.append($('<div class="context"/>').text(entry[2]));
+      list.append(item);
+    });
+    $('#search-results').before($('<h2/>').text('TLisp Functions'), list);
+  }
+};
+
+$(document).ready(function() {
+  if (!$('#search-results').length)
+    return;
+  var params = $.getQueryParameters();
+  var query = params.q ? $.trim(params.q[0]).split(/\s+/)[0] : '';
+  if (query)
+    TLispSearch.search(query.replace(/^\(/, ''));
+});
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.store
+    ~~~~~~~~~~~~~~~~~
+
+    The function catalogs of a Sphinx application.
+
+    The catalogs are kept in a TLispStore on the application, not in its
+    config, so they are never part of the pickled environment. When the
+    builder starts only a key of the function lists is computed; the
+    catalogs are read, from the catalog cache or the function lists, the
+    first time they are used. A build in which no function list changed and
+    no document is read does not load them at all.
+
+    Use get_catalog() to look up the catalog for an application or for the
+    document an environment is reading.
+"""
+import os.path
+import hashlib
+from collections import OrderedDict
+
+from sphinx.util.console import bold
+
+from .cache import cache_path, catalog_key, conversion_key, load_catalog, \
+    save_catalog
+from .fragments import FragmentStore, fragment_path
+from .tlisp import read_functions, parse_function_list, load_function_database
+from . import profile
+
+FINGERPRINT_FILE = 'tlisp-fingerprints.pickle'
+
+
+def version_list(app):
+    """Return the (label, function list) pairs of tlisp_versions, in order"""
+    versions = app.config.tlisp_versions
+    if isinstance(versions, dict):
+        versions = sorted(versions.items())
+    return list(versions)
+
+
+class TLispStore(object):
+    """
+    The current function catalog and those of the other API versions in
+    tlisp_versions, read when first used.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.fragments = FragmentStore(fragment_path(app))
+        self._functions = None      # type: TLispCatalog
+        self._versions = None       # type: Dict[unicode, TLispCatalog]
+        # The text of the function lists read, so each distinct signature
+        # and docstring is stored once
+        self.strings = {}           # type: Dict[unicode, unicode]
+        self.loaded = False
+        self.update_key()
+
+    def update_key(self):
+        """
+        Compute the keys of the function lists: *catalog_key* for the cache
+        of the current catalog, and *key* covering all the versions.
+        """
+        config = self.app.config
+        fn = config.tlisp_src
+        if not (fn and os.path.isfile(fn)):
+            self.catalog_key = self.key = None
+            return
+        self.catalog_key = catalog_key(fn, config)
+        h = hashlib.sha1(self.catalog_key.encode('ascii'))
+        for label, path in version_list(self.app):
+            if os.path.isfile(path):
+                h.update(('%s=%s' % (label, catalog_key(path, config)))
+                         .encode('utf-8'))
+        self.key = h.hexdigest()
+
+    @property
+    def functions(self):
+        """The current catalog, or None if there is no function list"""
+        if not self.loaded:
+            self.load()
+        return self._functions
+
+    @property
+    def versions(self):
+        """{label: catalog} of the other API versions"""
+        if not self.loaded:
+            self.load()
+        return self._versions
+
+    def get(self, version=None):
+        """Return the catalog of *version*, or the current one"""
+        if version:
+            return self.versions.get(version)
+        return self.functions
+
+    def load(self):
+        self.loaded = True
+        self._versions = OrderedDict()
+        if self.key is None:
+            return
+        with profile.phase(self.app, 'initialize'):
+            self._functions = self.read_catalog()
+            if self.app.config.tlisp_versions:
+                self._versions = self.read_versions()
+
+    def read_catalog(self):
+        app = self.app
+        functions = None
+        if app.config.tlisp_cache:
+            functions = load_catalog(cache_path(app), self.catalog_key)
+            if functions is not None:
+                print("[tlisp] Loaded function list from cache",
+                      cache_path(app))
+                functions.bind(app.config)
+                functions.modified = False
+        if functions is None:
+            functions = read_functions(app.config.tlisp_src, app,
+                                       self.strings)
+        if app.config.tlisp_cache:
+            functions.key = self.catalog_key
+        functions.profiler = profile.get_profiler(app)
+        if app.config.tlisp_workers > 1:
+            functions.convert_all(app.config.tlisp_workers)
+        return functions
+
+    def read_versions(self):
+        """
+        Read the function lists of the other API versions. All the catalogs
+        share their conversions and identical docstrings are only kept once.
+        """
+        app = self.app
+        shared = {}
+        self._functions.share(shared)
+        versions = OrderedDict()
+        for label, fn in version_list(app):
+            if not os.path.isfile(fn):
+                print(bold("[tlisp] Function list for version %s not found: %s"
+                           % (label, fn)))
+                continue
+            print("[tlisp] Reading version", label, "from", fn)
+            if fn.endswith('.jsonl'):
+                catalog = load_function_database(fn, app)
+            else:
+                catalog = parse_function_list(fn, app, self.strings)
+            catalog.share(shared)
+            catalog.profiler = profile.get_profiler(app)
+            if app.config.tlisp_workers > 1:
+                catalog.convert_all(app.config.tlisp_workers)
+            versions[label] = catalog
+        return versions
+
+    def replace(self, functions):
+        """Make *functions*, read again from tlisp_src, the current catalog"""
+        if not self.loaded:
+            self.load()
+        self.update_key()
+        if self._versions:
+            # Keep sharing conversions with the other versions
+            functions.share(next(iter(self._versions.values())).shared)
+        if self.app.config.tlisp_cache:
+            functions.key = self.catalog_key
+        functions.profiler = profile.get_profiler(self.app)
+        self._functions = functions
+
+    def fingerprints(self):
+        """
+        Return the fingerprints of all the functions, those of the other
+        versions as 'version/name'.
+        """
+        fps = dict(self.functions.fingerprints())
+        for version, catalog in self.versions.items():
+            for name, fp in catalog.fingerprints().items():
+                fps['%s/%s' % (version, name)] = fp
+        return fps
+
+    def fingerprint_path(self):
+        return os.path.join(self.app.doctreedir, FINGERPRINT_FILE)
+
+    def load_fingerprints(self, key):
+        """
+        Return (conversion key, fingerprints) as saved for the function lists
+        with *key*, or None
+        """
+        saved = load_catalog(self.fingerprint_path(), key)
+        if not isinstance(saved, tuple):
+            # Missing, or saved without the conversion key by earlier versions
+            return None
+        return saved
+
+    def save_fingerprints(self, fps):
+        """
+        Save the fingerprints of the current function lists, with the key of
+        the conversion settings they were rendered with
+        """
+        save_catalog(self.fingerprint_path(), self.key,
+                     (conversion_key(self.app.config), fps))
+
+    def save(self):
+        """Store any newly converted functions in the catalog cache"""
+        functions = self._functions
+        if functions is not None and functions.key and functions.modified:
+            with profile.phase(self.app, 'cache save'):
+                save_catalog(cache_path(self.app), functions.key, functions)
+            functions.modified = False
+
+
+def get_store(app_or_env):
+    """Return the TLispStore of a Sphinx application or environment"""
+    app = getattr(app_or_env, 'app', app_or_env)
+    return getattr(app, 'tlisp', None)
+
+
+def get_catalog(app_or_env, version=None):
+    """
+    Return the catalog of *version*, or None. For an environment the
+    default is the version the current document describes (see
+    tl:version), for an application the current catalog.
+    """
+    store = get_store(app_or_env)
+    if store is None:
+        return None
+    temp_data = getattr(app_or_env, 'temp_data', {})
+    return store.get(version or temp_data.get('tl:version'))
+
+
+def initialize(app):
+    app.tlisp = TLispStore(app)
+
+
+def preload(app, env, docnames):
+    """
+    Read the catalogs before the documents are read in parallel, so the
+    reader processes share them rather than each reading their own.
+    """
+    if docnames and app.parallel > 1 and not app.tlisp.loaded:
+        app.tlisp.load()
+
+
+def finalize(app, env):
+    app.tlisp.save()
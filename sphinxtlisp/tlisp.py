@@ -6,59 +6,177 @@
     The TLisp Function list parser.
 
 """
-import re
+import os
 import os.path
+import re
+import json
+import hashlib
 import traceback
 import warnings
 import textwrap
 import sys
+import time
 import imp
+import multiprocessing
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 
 from six import string_types
 
-from sphinx.util.console import bold
+from sphinx.ext.napoleon import Config
+from sphinx.util.tags import Tags
 from sphinx.ext.napoleon.iterators import modify_iter
 from sphinx.ext.napoleon.docstring import GoogleDocstring, _directive_regex, _google_section_regex
 
-from .domain import tlisp_sig_re
+from .signature import TLispSignature
+from .index import TLispNameIndex
+from . import profile
 
 _first_word_regex = re.compile(r'(\w+).*$')
-_multispace_regex = re.compile(r'\s\s+')
+_cell_regex = re.compile(r'\S+(?:\s\S+)*')
 _literal_regex = re.compile(r'(?<!\w)(\'\w+)(?![\w\'])')
 _fnclink_regex = re.compile(r'([a-z]+[A-Z][a-z]+\w*)')
+_inline_regex = re.compile('%s|%s' % (_literal_regex.pattern,
+                                      _fnclink_regex.pattern))
+_sentence_regex = re.compile(r"^([A-Z].*?\.)(?:\s|$)")
+_markup_regex = re.compile(r':[\w:]+:`([^`]*)`|``([^`]*)``|\*\*([^*]*)\*\*')
+
+# Below this many functions a process pool costs more than it saves
+POOL_THRESHOLD = 200
+
+def _inline_markup(docstring, allfuncs):
+    """
+    Quote 'literals and link known function names in a single pass.
+    *allfuncs* is a set of lower case function names.
+    """
+    def repl(match):
+        literal, fnc = match.groups()
+        if literal:
+            return '``' + literal + '``'
+        if fnc.lower() in allfuncs:
+            return ':tl:function:`' + fnc + '`'
+        return fnc
+    return _inline_regex.sub(repl, docstring)
+
+
+def _extract_summary(lines):
+    """
+    Return the first sentence of the first paragraph of the converted
+    *lines*, and the same sentence as plain text. The plain text is empty if
+    the docstring has no leading prose (e.g. it starts with the parameters).
+    """
+    doc = []
+    for line in lines:
+        if line.strip():
+            doc.append(line)
+        elif doc:
+            break
+    # Try to find the "first sentence", which may span multiple lines
+    m = _sentence_regex.search(" ".join(doc).strip())
+    if m:
+        summary = m.group(1).strip()
+    elif doc:
+        summary = doc[0].strip()
+    else:
+        summary = ''
+    if summary.startswith((':', '..')):
+        return summary, ''
+    text = _markup_regex.sub(lambda m: m.group(1) or m.group(2) or m.group(3),
+                             summary)
+    return summary, text
+
+
+def _table_row(line, columns, starts):
+    """
+    Return the cells of *line* as a row of the table with column *starts*,
+    or None if it does not belong to the table. *columns* are the
+    (position, text) runs of *line* separated by two or more spaces.
+
+    A row with as many runs as the table has columns is taken as is.
+    Otherwise it must line up: at least two runs, each beginning at a column
+    start, and no column start inside a word. This allows empty cells and
+    cells separated by a single space where the next one begins at its
+    column.
+    """
+    if len(columns) == len(starts):
+        return [text for _start, text in columns]
+    if len(columns) < 2 or columns[0][0] != starts[0]:
+        return None
+    for start, _text in columns:
+        if start not in starts:
+            return None
+    for start in starts[1:]:
+        if (start < len(line) and not line[start - 1].isspace()
+                and not line[start].isspace()):
+            return None
+    ends = starts[1:] + [len(line)]
+    return [line[start:end].strip() for start, end in zip(starts, ends)]
+
+
+class TLispFunction(namedtuple('TLispFunction', 'signature doc summary '
+                                                'summary_text params')):
+    """
+    A converted function as kept in the catalog: its TLispSignature, the
+    docstring converted to reStructuredText, the first sentence as reST and
+    as plain text, and the (name, type) pairs of its parameter sections.
+    The converter's state is not kept.
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.signature.name
+
+    @property
+    def tlisp_signature(self):
+        return self.signature.text
+
+    @property
+    def args(self):
+        return self.signature.args
+
+    @property
+    def retann(self):
+        return self.signature.retann
+
+
+def convert_function(signature, doc, config, allfuncs):
+    """Convert the docstring of a function into a TLispFunction record"""
+    return TLispDocstring(doc, config, what='function', signature=signature,
+                          allfuncs=allfuncs).record()
+
 
 class TLispDocstring(GoogleDocstring):
     def __init__(self, docstring, config=None, sig=None, what='', name='',
-               arglist='', retann='', allfuncs=[]):
+               arglist='', retann='', allfuncs=frozenset(), signature=None):
         self._config = config
 
         if not what:
             what = 'function'
 
-        if sig:
-            name, arglist, retann = tlisp_sig_re.match(sig).groups()
-            self.tlisp_signature = sig.strip()
+        if signature is None and sig:
+            signature = TLispSignature.parse(sig)
+        if signature is not None:
+            name, retann = signature.name, signature.retann
+            self.tlisp_signature = signature.text
+            self.args = signature.args
+        else:
+            self.args = [arg.strip('[]') for arg in arglist.split()]
 
         self._what = what
         self.name = name
-        self.args = [arg.strip('[]') for arg in arglist.split()]
+        self.signature = signature
         self.retann = retann
 
         if isinstance(docstring, string_types):
-            def lnkrepl(match):
-                if match.group(1).lower() in allfuncs:
-                    return ':tl:function:`'+match.group()+'`'
-                else:
-                    return match.group()
-            docstring = _literal_regex.sub(r'``\1``', docstring)
-            docstring = _fnclink_regex.sub(lnkrepl, docstring)
-            docstring = docstring.splitlines()
+            docstring = _inline_markup(docstring, allfuncs).splitlines()
         self._lines = docstring
         self._line_iter = modify_iter(docstring, modifier=lambda s: s.rstrip())
         self._parsed_lines = []  # type: List[unicode]
         self._is_in_section = False
         self._is_in_params = False
         self._param_fields = []
+        self._params = []
         self._section_indent = 0
         self._directive_sections = []
         self._sections = {
@@ -86,7 +204,15 @@ class TLispDocstring(GoogleDocstring):
                 } # type: Dict[unicode, Callable]
         self._parse()
         self.__doc__ = str(self)
+        self.summary, self.summary_text = _extract_summary(self._parsed_lines)
 
+    def record(self):
+        """Return the TLispFunction record of the converted docstring"""
+        summary_text = self.summary_text
+        if summary_text == self.summary:
+            summary_text = self.summary
+        return TLispFunction(self.signature, self.__doc__, self.summary,
+                             summary_text, tuple(self._params))
 
     def _is_section_header(self):
         self._is_in_params = False
@@ -123,6 +249,7 @@ class TLispDocstring(GoogleDocstring):
         _descs = self.__class__(_descs, self._config).lines()
 
         self._param_fields.append((_name, _type, _descs,))
+        self._params.append((_name, _type))
         return ['']
 
     def _parse(self):
@@ -164,37 +291,36 @@ class TLispDocstring(GoogleDocstring):
         Parse a generic section of text and look for TLisp extras
         e.g. space separated tables
         """
-        if not content:
-            return content
         lines = []
-        while content:
-            line = content.pop(0)
-            parts = _multispace_regex.split(line.strip())
-            if len(parts) < 2:
+        rows = starts = None
+        for line in content:
+            columns = [(m.start(), m.group()) for m in _cell_regex.finditer(line)]
+            if rows is not None:
+                row = _table_row(line, columns, starts)
+                if row is not None:
+                    rows.append(row)
+                    continue
+                lines.extend(self._format_table(rows))
+                rows = None
+            if len(columns) < 2:
                 lines.append(line)
             else:
-                desc = [parts]
-                ncol = len(parts)
-                width = [[len(p) for p in parts]]
-                while content:
-                    parts =_multispace_regex.split(content[0].strip())
-                    if len(parts) == ncol:
-                        content.pop(0)
-                        desc.append(parts)
-                        width.append([len(p) for p in parts])
-                    else:
-                        break
-                if len(width) == 1:
-                    width = width[0]
-                else:
-                    width = list(map(max,*width))
-                lines.append(u'')
-                lines.append(u'.. csv-table::')
-                lines.append(u'    :widths: ' + ','.join(map(str,width)))
-                lines.append(u'    :delim: \\')
-                lines.append(u'')
-                desc = ['\\'.join(parts) for parts in desc]
-                lines.extend(self._indent(desc, 4))
+                starts = [start for start, _text in columns]
+                rows = [[text for _start, text in columns]]
+        if rows is not None:
+            lines.extend(self._format_table(rows))
+        return lines
+
+    def _format_table(self, rows):
+        """
+        Return a tl:table directive for rows of cells. The rows are passed
+        as JSON, so the cells are never taken for markup or split again.
+        """
+        widths = [max(len(row[col]) for row in rows)
+                  for col in range(len(rows[0]))]
+        lines = [u'', u'.. tl:table::',
+                 u'    :widths: ' + ','.join(map(str, widths)), u'']
+        lines.extend([u'    ' + json.dumps(row) for row in rows])
         return lines
 
     def _format_fields(self, field_type, fields):
@@ -230,37 +356,340 @@ class TLispDocstring(GoogleDocstring):
         self._param_fields = []
 
 
-def initialize(app):
-    fn = app.config.tlisp_src
-    if (fn and os.path.isfile(fn)):
-        print("[tlisp] Parsing function list from", fn, "...")
-        functions = parse_function_list(fn, app)
-        app.config._tlispfuncs = functions
+class TLispCatalog(Mapping):
+    """
+    The TLisp function list, keyed on the lower case function name.
+
+    Only the signatures are parsed up front; each docstring is converted the
+    first time its function is looked up and the result is memoized.
+
+    Catalogs of several API versions can share their conversions through
+    *shared*, keyed on the function fingerprints, so a function that is the
+    same in two versions is only converted once.
+
+    Docstrings are converted with the napoleon settings in *config*. A
+    catalog read from a pickle, e.g. the catalog cache, has none and must
+    be given one with bind() before converting any more functions. Pickled,
+    a catalog only keeps the function list, the conversions and the
+    fingerprints; the name set, signatures and name index are rebuilt from
+    them.
 
-def parse_function_list(fnc_file, app):
+    Conversions are timed in *profiler*, that of the application using the
+    catalog (see sphinxtlisp.profile).
     """
-    Parse the Transcendence function list and import as dummy Python functions
+    def __init__(self, config=None):
+        self._config = config
+        self._raw = OrderedDict()   # type: Dict[unicode, Tuple[unicode, unicode]]
+        self._functions = {}        # type: Dict[unicode, TLispFunction]
+        self._signatures = {}       # type: Dict[unicode, TLispSignature]
+        self.allnames = set()       # type: Set[unicode]
+        self._fingerprints = None   # type: Dict[unicode, str]
+        self._index = None          # type: TLispNameIndex
+        self.shared = None          # type: Dict[str, TLispFunction]
+        self.profiler = profile.NULL
+        self.key = None
+        self.modified = False
+
+    def __getstate__(self):
+        return {'_raw': self._raw, '_functions': self._functions,
+                '_fingerprints': self._fingerprints, 'key': self.key}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._config = None
+        self._signatures = dict((name, obj.signature)
+                                for name, obj in self._functions.items())
+        self.allnames = set(self._raw)
+        self._index = None
+        self.shared = None
+        self.profiler = profile.NULL
+        self.modified = False
+
+    def bind(self, config):
+        """Convert docstrings with the napoleon settings of *config*"""
+        self._config = config
+        return self
+
+    @property
+    def config(self):
+        if self._config is None:
+            raise ValueError('No napoleon config to convert the TLisp '
+                             'docstrings with: read the function list with '
+                             'an app, or call bind(config)')
+        return self._config
+
+    def add(self, sig, doc, signature=None):
+        if signature is None:
+            signature = TLispSignature.parse(sig)
+        name = signature.name
+        self._raw[name.lower()] = (sig, doc)
+        self._signatures[name.lower()] = signature
+        self._functions.pop(name.lower(), None)
+        self.allnames.add(name.lower())
+        self._fingerprints = None
+        self._index = None
+        self.modified = True
+
+    def __getitem__(self, name):
+        try:
+            return self._functions[name]
+        except KeyError:
+            pass
+        obj = self._shared_get(name)
+        if obj is not None:
+            return obj
+        doc = self._raw[name][1]
+        started = time.time()
+        obj = convert_function(self.signature(name), doc, self.config,
+                               self.allnames)
+        stats = self.profiler.stats
+        if stats is not None:
+            _note_conversion(stats, name, obj, time.time() - started)
+        self._functions[name] = obj
+        if self.shared is not None:
+            self.shared[self.fingerprints()[name]] = obj
+        self.modified = True
+        return obj
+
+    def _shared_get(self, name):
+        """Take the conversion of *name* from the shared store, if there"""
+        if self.shared is None or name not in self._raw:
+            return None
+        obj = self.shared.get(self.fingerprints()[name])
+        if obj is not None:
+            self._functions[name] = obj
+            self.modified = True
+            self.profiler.count('conversions shared')
+        return obj
+
+    def share(self, shared):
+        """
+        Share conversions with other catalogs through the dict *shared*,
+        adding the functions this catalog has already converted.
+        """
+        fingerprints = self.fingerprints()
+        for name, obj in self._functions.items():
+            shared.setdefault(fingerprints[name], obj)
+        self.shared = shared
+
+    def __contains__(self, name):
+        return name in self._raw
+
+    def signature(self, name):
+        """Return the parsed signature of function *name*"""
+        try:
+            return self._signatures[name]
+        except KeyError:
+            pass
+        signature = TLispSignature.parse(self._raw[name][0])
+        self._signatures[name] = signature
+        return signature
+
+    def raw(self, name):
+        """Return the (signature, docstring) of *name* as in the function list"""
+        return self._raw[name]
+
+    def raw_items(self):
+        """
+        Iterate over the (name, (signature, docstring)) pairs as in the
+        function list, in catalog order
+        """
+        return iter(self._raw.items())
+
+    def find_signature(self, sig):
+        """
+        Return the parsed signature of the function whose signature is
+        *sig*, or None if there is no such function.
+        """
+        sig = sig.strip()
+        words = sig[1:].split(None, 1)
+        if not sig.startswith('(') or not words:
+            return None
+        name = words[0].rstrip(')').lower()
+        if name not in self._raw:
+            return None
+        signature = self.signature(name)
+        return signature if signature.text == sig else None
+
+    def match(self, pattern):
+        """Return the names of the functions matching a glob pattern"""
+        if self._index is None:
+            self._index = TLispNameIndex(list(self._raw))
+        return self._index.match(pattern)
+
+    def convert_all(self, workers=1):
+        """
+        Convert every function not yet converted. With more than one worker
+        large catalogs are sharded across a process pool; the results are
+        collected in catalog order.
+        """
+        pending = [name for name in self._raw if name not in self._functions
+                   and self._shared_get(name) is None]
+        if workers > 1 and len(pending) >= POOL_THRESHOLD:
+            settings = dict((name, getattr(self.config, name))
+                            for name in Config._config_values)
+            size = -(-len(pending) // (workers * 4))
+            shards = [pending[i:i + size] for i in range(0, len(pending), size)]
+            pool = multiprocessing.Pool(workers, _init_worker,
+                                        (settings, self.allnames))
+            try:
+                with self.profiler.phase('conversion (pool)'):
+                    results = pool.map(_convert_shard,
+                                       [[(self.signature(name),
+                                          self._raw[name][1])
+                                         for name in shard]
+                                        for shard in shards], 1)
+            finally:
+                pool.close()
+                pool.join()
+            stats = self.profiler.stats
+            for shard, converted in zip(shards, results):
+                for name, (obj, seconds) in zip(shard, converted):
+                    self._functions[name] = obj
+                    if stats is not None:
+                        _note_conversion(stats, name, obj, seconds)
+            if self.shared is not None:
+                fingerprints = self.fingerprints()
+                for name in pending:
+                    self.shared[fingerprints[name]] = self._functions[name]
+            self.modified = True
+        else:
+            for name in pending:
+                self[name]
+
+    def fingerprints(self):
+        """
+        Return a digest for each function covering everything that affects
+        its rendered output: the signature, docstring and which of the words
+        in the docstring become links to other functions.
+        """
+        if self._fingerprints is None:
+            index = self.allnames
+            fps = {}
+            for name, (sig, doc) in self._raw.items():
+                links = set(m.lower() for m in _fnclink_regex.findall(doc))
+                h = hashlib.sha1()
+                h.update(sig.encode('utf-8'))
+                h.update(doc.encode('utf-8'))
+                h.update(' '.join(sorted(links & index)).encode('utf-8'))
+                fps[name] = h.hexdigest()
+            self._fingerprints = fps
+        return self._fingerprints
+
+    def reuse(self, other):
+        """
+        Take over the converted functions of an earlier catalog *other* whose
+        fingerprints have not changed. Returns the names of the functions
+        added, removed or changed since.
+        """
+        old, new = other.fingerprints(), self.fingerprints()
+        for name, fp in new.items():
+            if old.get(name) == fp and name in other._functions:
+                self._functions[name] = other._functions[name]
+        return set(name for name in set(old) | set(new)
+                   if old.get(name) != new.get(name))
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+
+_worker_args = None
+
+def _init_worker(settings, allnames):
+    global _worker_args
+    _worker_args = (Config(**settings), allnames)
+
+def _convert_shard(records):
+    """
+    Convert a list of (signature, docstring) records in a pool worker,
+    returning a (TLispFunction, seconds) pair for each
+    """
+    config, allnames = _worker_args
+    results = []
+    for signature, doc in records:
+        started = time.time()
+        obj = convert_function(signature, doc, config, allnames)
+        results.append((obj, time.time() - started))
+    return results
+
+
+def _note_conversion(stats, name, obj, seconds):
+    """Add the conversion of *name* into *obj* to the BuildStats *stats*"""
+    stats.note_conversion(name, seconds)
+    stats.count('links created', obj.doc.count(':tl:function:`'))
+    stats.count('tables converted', obj.doc.count('.. tl:table::'))
+
+
+def napoleon_config(confdir):
+    """
+    Return the napoleon Config set in the conf.py of *confdir*, for
+    converting docstrings as the Sphinx build does without running it
+    """
+    path = os.path.join(confdir, 'conf.py')
+    namespace = {'__file__': os.path.abspath(path), 'tags': Tags()}
+    with open(path, 'rb') as fh:
+        code = compile(fh.read(), path, 'exec')
+    # conf.py runs in its own directory, as in a Sphinx build
+    cwd = os.getcwd()
+    os.chdir(confdir)
+    try:
+        exec(code, namespace)
+    finally:
+        os.chdir(cwd)
+    return Config(**dict((name, namespace[name])
+                         for name in Config._config_values
+                         if name in namespace))
+
+
+def read_functions(fn, app=None, strings=None):
+    """
+    Read a function list, or a function database, into a catalog. *strings*
+    is passed on to parse_function_list.
     """
-    funclist = []
-    allnames = []
-    class Obj:
-        pass
-    obj = None
+    if fn.endswith('.jsonl'):
+        print("[tlisp] Loading function database from", fn)
+        return load_function_database(fn, app)
+    print("[tlisp] Parsing function list from", fn, "...")
+    functions = parse_function_list(fn, app, strings)
+    profile.count(app, 'functions parsed', len(functions))
+    return functions
+
+def parse_function_list(fnc_file, app=None, strings=None):
+    """
+    Parse the Transcendence function list into a catalog. Only signatures are
+    parsed here, docstrings are converted on demand. If *strings* is given,
+    signatures and docstrings equal to one already in it are replaced by
+    that one, so lists read with the same dict share their text.
+    """
+    catalog = TLispCatalog(getattr(app, 'config', None))
+    sig = None
+    doc = []
+
+    signature = None
+
+    def add(sig, doc):
+        if strings is not None:
+            sig = strings.setdefault(sig, sig)
+            doc = strings.setdefault(doc, doc)
+        catalog.add(sig, doc, signature)
+
     with open(fnc_file) as fh:
         for line in fh:
-            m = tlisp_sig_re.match(line)
-            if m:
+            parsed = TLispSignature.parse(line)
+            if parsed is not None:
                 # We have a new function
-                obj = Obj()
-                obj.sig = line
-                obj.doc = ''
-                funclist.append(obj)
-                allnames.append(m.group(1).lower())
-            elif obj:
-                obj.doc += line
-
-    funclist = [TLispDocstring(f.doc, app.config, what='function', sig=f.sig, allfuncs=allnames) for f in funclist]
-    fd = {f.name.lower(): f for f in funclist}
+                if sig:
+                    add(sig, ''.join(doc))
+                sig = line
+                signature = parsed
+                doc = []
+            elif sig:
+                doc.append(line)
+    if sig:
+        add(sig, ''.join(doc))
 
     #for key, obj in funcdict.items():
     #    obj.translate_docstring(app.config, funcdict)
@@ -270,4 +699,19 @@ def parse_function_list(fnc_file, app):
     #    obj.__module__ = mod
     #    setattr(mod, obj.__name__, obj)
 
-    return fd
+    return catalog
+
+
+def load_function_database(fnc_file, app=None):
+    """
+    Open a function database (see sphinxtlisp.database) as a catalog. The
+    records are read from the memory mapped database as they are needed.
+    """
+    from .database import FunctionDatabase
+
+    db = FunctionDatabase(fnc_file)
+    catalog = TLispCatalog(getattr(app, 'config', None))
+    catalog._raw = db
+    catalog.allnames = set(db)
+    catalog._fingerprints = db.fingerprints
+    return catalog
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxtlisp.watch
+    ~~~~~~~~~~~~~~~~~
+
+    Rebuild the documentation whenever the function list or a source file
+    changes, and serve the output::
+
+        python -m sphinxtlisp.watch [sourcedir] [outdir] [-b html] [-p 8000]
+
+    One Sphinx application is kept for the whole session. When ``tlisp_src``
+    is saved only the signatures are re-read: functions whose fingerprints
+    have not changed keep their converted docstrings, and the environment's
+    outdated check rereads just the pages that use the changed ones. The
+    function lists of ``tlisp_versions`` are read once, when first used.
+"""
+import os
+import os.path
+import sys
+import time
+import argparse
+import traceback
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from threading import Thread
+
+from sphinx.application import Sphinx
+
+from . import profile
+from .tlisp import read_functions
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(root, port):
+    """Serve the directory *root* on *port* from a background thread"""
+    server = ThreadingHTTPServer(('localhost', port),
+                                 partial(_QuietHandler, directory=root))
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print("[tlisp] Serving %s at http://localhost:%d/" % (root, port))
+    return server
+
+
+class TLispWatcher(object):
+    """Keep a Sphinx application and its catalogs, and rebuild on changes"""
+
+    def __init__(self, app):
+        self.app = app
+        self.mtimes = {}
+
+    def snapshot(self):
+        """Return {path: mtime} for the function list and the sources"""
+        mtimes = {}
+        skip = set(os.path.abspath(d) for d in (self.app.outdir,
+                                                 self.app.doctreedir))
+        fn = self.app.config.tlisp_src
+        if fn and os.path.isfile(fn):
+            mtimes[fn] = os.stat(fn).st_mtime
+        for dirpath, dirnames, filenames in os.walk(self.app.srcdir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and
+                           os.path.abspath(os.path.join(dirpath, d)) not in skip]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    mtimes[path] = os.stat(path).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def reload_functions(self):
+        """Re-read the function list, reusing unchanged conversions"""
+        store = self.app.tlisp
+        old = store.functions
+        functions = read_functions(self.app.config.tlisp_src, self.app,
+                                   store.strings)
+        if old is not None:
+            changed = functions.reuse(old)
+        else:
+            changed = set(functions)
+        store.replace(functions)
+        print("[tlisp] %d functions to reconvert" % len(changed))
+
+    def build(self):
+        start = time.time()
+        try:
+            self.app.build()
+        except Exception:
+            traceback.print_exc()
+        print("[tlisp] Rebuilt in %.2fs" % (time.time() - start))
+
+    def run(self, interval=0.5):
+        self.mtimes = self.snapshot()
+        self.build()
+        print("[tlisp] Watching for changes, press Ctrl-C to stop")
+        while True:
+            time.sleep(interval)
+            mtimes = self.snapshot()
+            if mtimes == self.mtimes:
+                continue
+            # builder-inited started the profile of the first build only
+            profile.start_profile(self.app)
+            fn = self.app.config.tlisp_src
+            if mtimes.get(fn) != self.mtimes.get(fn):
+                self.reload_functions()
+            self.mtimes = mtimes
+            self.build()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sphinxtlisp.watch',
+        description='Rebuild and serve the documentation as it changes')
+    parser.add_argument('sourcedir', nargs='?', default='source')
+    parser.add_argument('outdir', nargs='?',
+                        help='output directory (default build/<builder>)')
+    parser.add_argument('-b', '--builder', default='html')
+    parser.add_argument('-d', '--doctreedir',
+                        help='doctree directory (default build/doctrees, '
+                             'as used by make)')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='port to serve the output on (0 to not serve)')
+    parser.add_argument('-i', '--interval', type=float, default=0.5,
+                        help='seconds between checks for changes')
+    args = parser.parse_args(argv)
+
+    outdir = args.outdir or os.path.join('build', args.builder)
+    doctreedir = args.doctreedir or os.path.join('build', 'doctrees')
+    app = Sphinx(args.sourcedir, args.sourcedir, outdir, doctreedir,
+                 args.builder)
+    if args.port:
+        serve(os.path.abspath(outdir), args.port)
+    try:
+        TLispWatcher(app).run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
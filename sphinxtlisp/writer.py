@@ -7,14 +7,21 @@
 
 from docutils import nodes
 
+from .nodes import tlisp_optional
+
 def noop(self, node):
     pass
 
+def _separated(node):
+    # An optional parameter is separated before its bracket
+    return not isinstance(node.parent, tlisp_optional)
+
 def visit_html_parameter(self, node):
     # type: (nodes.Node) -> None
     if self.first_param:
         self.first_param = 0
-    self.body.append(self.param_separator)
+    if _separated(node):
+        self.body.append(self.param_separator)
     if self.optional_param_level == 0:
         self.required_params_left -= 1
     if not node.hasattr('noemph'):
@@ -25,11 +32,23 @@ def depart_html_parameter(self, node):
     if not node.hasattr('noemph'):
         self.body.append('</em>')
 
+def visit_html_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.body.append(self.param_separator)
+    self.optional_param_level += 1
+    self.body.append('<span class="optional">[</span>')
+
+def depart_html_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.optional_param_level -= 1
+    self.body.append('<span class="optional">]</span>')
+
 def visit_latex_parameter(self, node):
     # type: (nodes.Node) -> None
     if self.first_param:
         self.first_param = 0
-    self.body.append(self.param_separator)
+    if _separated(node):
+        self.body.append(self.param_separator)
     if not node.hasattr('noemph'):
         self.body.append(r'\emph{')
 
@@ -38,25 +57,53 @@ def depart_latex_parameter(self, node):
     if not node.hasattr('noemph'):
         self.body.append('}')
 
+def visit_latex_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.body.append(self.param_separator)
+    self.body.append(r'\sphinxoptional{')
+
+def depart_latex_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.body.append('}')
+
 def visit_texinfo_parameter(self, node):
     # type: (nodes.Node) -> None
     if self.first_param:
         self.first_param = 0
-    self.body.append(self.param_separator)
+    if _separated(node):
+        self.body.append(self.param_separator)
     text = self.escape(node.astext())
     # replace no-break spaces with normal ones
     text = text.replace(u' ', '@w{ }')
     self.body.append(text)
     raise nodes.SkipNode
 
+def visit_texinfo_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.body.append(self.param_separator)
+    self.body.append('[')
+
+def depart_texinfo_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.body.append(']')
+
 def visit_text_parameter(self, node):
     # type: (nodes.Node) -> None
     if self.first_param:
         self.first_param = 0
-    self.add_text(' ')
+    if _separated(node):
+        self.add_text(' ')
     self.add_text(node.astext())
     raise nodes.SkipNode
 
+def visit_text_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.add_text(' [')
+
+def depart_text_optional(self, node):
+    # type: (nodes.Node) -> None
+    self.add_text(']')
+
 
 def redirect(nodetype):
     """